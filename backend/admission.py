@@ -0,0 +1,316 @@
+"""Per-user admission control and fair scheduling of Gemini work.
+
+Every analysis that will call Gemini is admitted against limits keyed on
+the user; results answered from the cache are not charged. The limits are a
+token bucket (ADMISSION_RATE_PER_MINUTE, bursts of ADMISSION_BURST) and a
+cap on the user's analyses in flight (ADMISSION_MAX_CONCURRENT_PER_USER).
+ADMISSION_MAX_IN_FLIGHT bounds the analyses admitted across all users.
+Requests over a limit are refused straight away with Retry-After and
+X-Queue-Position rather than waiting for capacity.
+
+Admitted work shares the Gemini slots through a ``FairScheduler``, which
+hands each freed slot to the next user in round-robin order, so one user's
+backlog cannot starve everyone else's requests.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from auth import token_user_id
+from observability import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_REJECTIONS,
+    GEMINI_QUEUE_DEPTH,
+    GEMINI_QUEUE_WAIT_SECONDS,
+    GEMINI_SLOTS_IN_USE,
+    get_logger,
+)
+
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "6"))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "3"))
+ADMISSION_MAX_CONCURRENT_PER_USER = int(os.getenv("ADMISSION_MAX_CONCURRENT_PER_USER", "2"))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+# Expected analysis time until enough have finished to measure it
+ADMISSION_INITIAL_ESTIMATE_SECONDS = 30.0
+ESTIMATE_SMOOTHING = 0.2
+
+# POSTs that upload a video for analysis; the middleware turns away
+# over-limit users before the upload is read. Resumable uploads are checked
+# when they are finalized, so starting one is never refused.
+ADMISSION_PATH_PREFIXES = ("/api/analyze-video/", "/api/analyze-batch")
+QUEUE_POSITION_HEADER = "X-Queue-Position"
+
+# The user that Gemini calls made in the current task are scheduled for
+gemini_user_var: ContextVar[Optional[int]] = ContextVar("gemini_user", default=None)
+
+logger = get_logger(__name__)
+
+
+@contextmanager
+def on_behalf_of(user_id: Optional[int]):
+    """Schedules the Gemini calls made inside the block as ``user_id``'s."""
+    token = gemini_user_var.set(user_id)
+    try:
+        yield
+    finally:
+        gemini_user_var.reset(token)
+
+
+class FairScheduler:
+    """A semaphore that serves waiting users in round-robin order.
+
+    Each user has a FIFO of waiters. A freed slot goes to the first waiter
+    of the next user in the rotation, so a user with many calls queued gets
+    one slot per turn like everyone else.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._in_use = 0
+        # Insertion order is the rotation; a served user moves to the back
+        self._waiters: Dict[Optional[int], Deque[asyncio.Future]] = {}
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def position(self, user_id: Optional[int]) -> int:
+        """Roughly how many queued calls would go before a new one from ``user_id``."""
+        turn = len(self._waiters.get(user_id, ())) + 1
+        return sum(min(len(queue), turn) for key, queue in self._waiters.items() if key != user_id) + turn - 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int] = None):
+        await self.acquire(gemini_user_var.get() if user_id is None else user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: Optional[int]):
+        if self._in_use < self.slots and not self._waiters:
+            self._take()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(waiter)
+        GEMINI_QUEUE_DEPTH.set(self.depth)
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self.release()
+            else:
+                self._forget(user_id, waiter)
+            raise
+        finally:
+            GEMINI_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def release(self):
+        self._in_use -= 1
+        GEMINI_SLOTS_IN_USE.set(self._in_use)
+        self._wake()
+
+    def _take(self):
+        self._in_use += 1
+        GEMINI_SLOTS_IN_USE.set(self._in_use)
+
+    def _wake(self):
+        while self._in_use < self.slots and self._waiters:
+            user_id, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            del self._waiters[user_id]
+            if queue:
+                self._waiters[user_id] = queue
+            if waiter.done():
+                continue
+            self._take()
+            waiter.set_result(None)
+        GEMINI_QUEUE_DEPTH.set(self.depth)
+
+    def _forget(self, user_id: Optional[int], waiter: asyncio.Future):
+        queue = self._waiters.get(user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiters[user_id]
+        GEMINI_QUEUE_DEPTH.set(self.depth)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int, now: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available; 0 if one is available now."""
+        missing = 1 - self.refill(now)
+        return max(missing, 0) / self.rate
+
+
+class Admission:
+    """One admitted analysis; releasing it frees the user's slot (idempotent)."""
+
+    def __init__(self, controller: "AdmissionController", user_id: int):
+        self.controller = controller
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __enter__(self) -> "Admission":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        scheduler: FairScheduler,
+        rate_per_minute: float = ADMISSION_RATE_PER_MINUTE,
+        burst: int = ADMISSION_BURST,
+        max_concurrent_per_user: int = ADMISSION_MAX_CONCURRENT_PER_USER,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+    ):
+        self.scheduler = scheduler
+        self.rate = rate_per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_concurrent_per_user = max_concurrent_per_user
+        self.max_in_flight = max_in_flight
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._active: Dict[int, Deque[Admission]] = {}
+        self._in_flight = 0
+        self._estimate = ADMISSION_INITIAL_ESTIMATE_SECONDS
+        self._pruned_at = time.monotonic()
+
+    def admit(self, user_id: int) -> Admission:
+        """Admits one analysis for ``user_id`` or raises 429/503 right away."""
+        now = time.monotonic()
+        self.check(user_id, now)
+        if self.rate > 0:
+            self._bucket(user_id, now).tokens -= 1
+        admission = Admission(self, user_id)
+        self._active.setdefault(user_id, deque()).append(admission)
+        self._in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self._in_flight)
+        return admission
+
+    def exempt(self, user_id: int) -> Admission:
+        """A ticket for an analysis that never reaches Gemini, such as a cached
+        result; it is not charged against any limit."""
+        admission = Admission(self, user_id)
+        admission.released = True
+        return admission
+
+    def check(self, user_id: int, now: Optional[float] = None):
+        """Raises the rejection ``admit`` would, without admitting anything."""
+        now = time.monotonic() if now is None else now
+        position = self.scheduler.position(user_id)
+        active = self._active.get(user_id, ())
+
+        if 0 < self.max_concurrent_per_user <= len(active):
+            # The user's oldest analysis is the likeliest to finish first
+            retry_after = self._estimate - (now - active[0].started)
+            self._reject(user_id, "concurrency", 429, retry_after, position, (
+                f"You already have {len(active)} analyses in progress. "
+                "Please wait for one to finish before starting another."
+            ))
+        if 0 < self.max_in_flight <= self._in_flight:
+            retry_after = self._estimate * (position + 1) / max(self.scheduler.slots, 1)
+            self._reject(user_id, "capacity", 503, retry_after, position,
+                         "The server is busy with other analyses. Please try again shortly.")
+        if self.rate > 0:
+            wait = self._bucket(user_id, now).wait_time(now)
+            if wait > 0:
+                self._reject(user_id, "rate", 429, wait, position,
+                             "Too many analyses started recently. Please wait a moment before starting another.")
+
+    def _reject(self, user_id: int, reason: str, status_code: int, retry_after: float, position: int, detail: str):
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        retry_after = max(math.ceil(retry_after), 1)
+        logger.info("analysis not admitted", extra={
+            "user_id": user_id, "reason": reason, "retry_after": retry_after, "queue_position": position,
+        })
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(retry_after), QUEUE_POSITION_HEADER: str(position)},
+        )
+
+    def _bucket(self, user_id: int, now: float) -> TokenBucket:
+        self._prune(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as a new one
+        if now - self._pruned_at < self.burst / self.rate:
+            return
+        self._pruned_at = now
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.refill(now) >= bucket.capacity:
+                del self._buckets[user_id]
+
+    def _release(self, admission: Admission):
+        active = self._active.get(admission.user_id)
+        if active is not None and admission in active:
+            active.remove(admission)
+            if not active:
+                del self._active[admission.user_id]
+        self._in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self._in_flight)
+        seconds = time.monotonic() - admission.started
+        self._estimate += ESTIMATE_SMOOTHING * (seconds - self._estimate)
+
+
+class AdmissionMiddleware:
+    """Turns away over-limit users before their upload is read.
+
+    The user id comes from the bearer token's claims; the endpoint still
+    authenticates the request and admits it for real.
+    """
+
+    def __init__(self, app, admission: AdmissionController):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(ADMISSION_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        user_id = token_user_id(token) if scheme.lower() == "bearer" else None
+        if user_id is not None:
+            try:
+                self.admission.check(user_id)
+            except HTTPException as e:
+                response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,513 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from admission import FairScheduler
+from gemini_service import sdk_errors, sdk_types
+from motion import analyze_motion
+from observability import POLL_ITERATIONS, REJECTIONS, UPLOAD_BYTES, get_logger, span
+from video_processing import normalize_video
+
+logger = get_logger(__name__)
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+FILE_PROCESSING_TIMEOUT = 60  # Maximum seconds to wait for files to become ACTIVE
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 4.0
+POLL_BACKOFF = 1.5
+BATCH_GENERATE_CONCURRENCY = int(os.getenv("BATCH_GENERATE_CONCURRENCY", "4"))
+
+# Caps uploads and generations in flight across all requests on this worker
+# and shares them out between users in turn. Status polls are cheap metadata
+# reads and do not take a slot.
+gemini_slots = FairScheduler(GEMINI_MAX_CONCURRENCY)
+
+
+async def upload_video(gemini, path: Path):
+    async with gemini_slots.slot():
+        return await gemini.upload_file(path)
+
+
+class FileGone(Exception):
+    """A file uploaded earlier was deleted or evicted on the Gemini side."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Gemini file {name} is no longer available")
+        self.name = name
+
+
+def is_file_gone(error: BaseException) -> bool:
+    # The fake backend raises FileNotFoundError where Gemini answers 404
+    if isinstance(error, (FileGone, FileNotFoundError)):
+        return True
+    return isinstance(error, sdk_errors().ClientError) and error.code in (403, 404)
+
+
+async def get_file_state(gemini, name: str):
+    try:
+        return await gemini.get_file(name)
+    except FileGone:
+        raise
+    except Exception as e:
+        if is_file_gone(e):
+            raise FileGone(name) from e
+        raise
+
+
+async def poll_files(
+    gemini,
+    files,
+    timeout: float = FILE_PROCESSING_TIMEOUT,
+    stop_on_failure: bool = False,
+    errors: Optional[Dict[str, BaseException]] = None,
+) -> Dict[str, object]:
+    """Poll files concurrently, backing off between rounds, until each is ACTIVE or FAILED.
+
+    Returns the settled state of each file by name; files still processing at
+    the timeout are left out. With ``stop_on_failure`` it returns as soon as
+    any file fails. A status read that raises ends the poll, unless
+    ``errors`` is given: then the error is recorded there under the file's
+    name and that file is no longer polled.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = POLL_INITIAL_DELAY
+    pending = {f.name for f in files}
+    settled = {}
+    rounds = 0
+    while pending:
+        rounds += 1
+        names = list(pending)
+        states = await asyncio.gather(
+            *(get_file_state(gemini, name) for name in names), return_exceptions=errors is not None
+        )
+        for name, state in zip(names, states):
+            if isinstance(state, BaseException):
+                errors[name] = state
+                pending.discard(name)
+            elif state.state in ("ACTIVE", "FAILED"):
+                settled[name] = state
+                pending.discard(name)
+        if stop_on_failure and any(name in settled and settled[name].state == "FAILED" for name in names):
+            break
+
+        remaining = deadline - loop.time()
+        if not pending or remaining <= 0:
+            break
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+    POLL_ITERATIONS.observe(rounds)
+    return settled
+
+
+async def wait_for_files(gemini, *files, timeout: float = FILE_PROCESSING_TIMEOUT):
+    """Wait until all files are ACTIVE, or until any of them fails."""
+    settled = await poll_files(gemini, files, timeout, stop_on_failure=True)
+    if any(s.state == "FAILED" for s in settled.values()):
+        # Files that have not settled yet are still processing, not failed
+        return [settled.get(f.name, f) for f in files]
+    if len(settled) < len(files):
+        raise HTTPException(status_code=500, detail="File processing timeout")
+    return [settled[f.name] for f in files]
+
+
+def file_failure_message(file_state_user, file_state_reference) -> Optional[str]:
+    if file_state_user.state != "FAILED" and file_state_reference.state != "FAILED":
+        return None
+
+    # Get detailed error information
+    user_error = getattr(file_state_user, 'error', 'Unknown error') if file_state_user.state == "FAILED" else None
+    ref_error = getattr(file_state_reference, 'error', 'Unknown error') if file_state_reference.state == "FAILED" else None
+
+    error_details = []
+    if user_error:
+        error_details.append(f"Your video failed: {user_error}")
+    if ref_error:
+        error_details.append(f"Reference video failed: {ref_error}")
+
+    error_msg = " | ".join(error_details) if error_details else "File processing failed"
+
+    # Add helpful message for user video failures
+    if file_state_user.state == "FAILED":
+        error_msg += ". Try converting your video to MP4 format or reducing its size/length."
+
+    logger.warning("file processing failed", extra={
+        "user_state": file_state_user.state,
+        "reference_state": file_state_reference.state,
+        "error": error_msg,
+    })
+    return error_msg
+
+
+class NoMotionDetected(Exception):
+    pass
+
+
+def no_motion_rejection(sport: str) -> str:
+    # Same shape as the REJECTED answers the prompts ask Gemini for
+    return (
+        f"REJECTED: No movement was detected in this video. "
+        f"Please upload a video of yourself performing a {sport} motion."
+    )
+
+
+async def normalize_and_upload(gemini, user_path: Path, timings: dict, temp_storage=None):
+    """Prefilter, trim and normalize the clip locally, then upload it.
+
+    Raises NoMotionDetected for static clips so they never reach Gemini.
+    """
+    trim = None
+    with span("motion", logger, timings) as fields:
+        motion = await analyze_motion(user_path)
+        if motion is not None:
+            fields.update(peak_energy=round(motion.peak_energy, 4), duration=motion.duration,
+                          trimmed_seconds=round(motion.trimmed_seconds, 2))
+            if motion.static:
+                fields["rejected"] = True
+            trim = motion.window
+    if motion is not None and motion.static:
+        raise NoMotionDetected()
+
+    with span("normalize", logger, timings) as fields:
+        normalized = await normalize_video(user_path, trim, temp_storage)
+        fields.update(original_bytes=normalized.original_bytes, normalized_bytes=normalized.normalized_bytes,
+                      normalized=normalized.normalized, trimmed=normalized.trimmed)
+    UPLOAD_BYTES.labels("gemini").observe(normalized.normalized_bytes)
+    try:
+        with span("upload", logger, timings, bytes=normalized.normalized_bytes):
+            return await upload_video(gemini, normalized.path)
+    finally:
+        normalized.close()
+
+
+async def generate_analysis(
+    gemini,
+    prompt: str,
+    user_file,
+    reference_file,
+    on_text: Optional[Callable[[str], None]] = None,
+    context=None,
+) -> str:
+    """Generate the comparison, streaming through ``on_text`` when given.
+
+    With a cached ``context`` (see context_cache.py) the prompt and reference
+    clip are already on the Gemini side, so only the user's video is sent.
+    """
+    types = sdk_types()
+    user_part = types.Part.from_uri(file_uri=user_file.uri, mime_type=user_file.mime_type)
+    if context is not None:
+        contents = ["User's video:", user_part]
+        config = types.GenerateContentConfig(cached_content=context.name)
+    else:
+        contents = [
+            prompt,
+            user_part,
+            types.Part.from_uri(file_uri=reference_file.uri, mime_type=reference_file.mime_type),
+        ]
+        config = None
+
+    async with gemini_slots.slot():
+        started = time.perf_counter()
+        if on_text is None:
+            response = await gemini.generate(contents, config)
+            _log_usage(response.usage_metadata, time.perf_counter() - started, context)
+            return response.text
+
+        parts = []
+        usage = {}
+        async for text in gemini.generate_stream(contents, config, usage):
+            parts.append(text)
+            on_text(text)
+        _log_usage(usage.get("metadata"), time.perf_counter() - started, context)
+        return "".join(parts)
+
+
+def _log_usage(usage, seconds: float, context):
+    logger.info("gemini generation", extra={
+        "seconds": round(seconds, 4),
+        "input_tokens": getattr(usage, "prompt_token_count", None),
+        "cached_tokens": getattr(usage, "cached_content_token_count", None),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+        "context_cache": context.name if context else None,
+    })
+
+
+async def generate_with_context(
+    gemini,
+    context_cache,
+    sport: str,
+    prompt: str,
+    user_file,
+    reference_file,
+    context,
+    on_text: Optional[Callable[[str], None]] = None,
+) -> str:
+    # A cached context can disappear on the Gemini side before our TTL says
+    # so; fall back to a full request unless text has already gone out
+    if context is not None:
+        emitted = False
+
+        def forward(text: str):
+            nonlocal emitted
+            emitted = True
+            on_text(text)
+
+        try:
+            return await generate_analysis(
+                gemini, prompt, user_file, reference_file,
+                forward if on_text else None, context,
+            )
+        except sdk_errors().ClientError as e:
+            if emitted or e.code not in (400, 403, 404):
+                raise
+            logger.warning("generation with context cache failed, retrying without it",
+                           extra={"context_cache": context.name, "error": str(e)})
+            context_cache.invalidate(sport)
+    return await generate_analysis(gemini, prompt, user_file, reference_file, on_text)
+
+
+async def prepare_reference(reference_registry, context_cache, sport: str, prompt: str):
+    with span("reference", logger, sport=sport):
+        reference_file = await reference_registry.get(sport)
+        context = await context_cache.get(sport, prompt, reference_file) if context_cache else None
+    return reference_file, context
+
+
+async def replace_reference(reference_registry, context_cache, sport: str, prompt: str, stale):
+    """Uploads the reference again after its Gemini file went missing before expiry."""
+    logger.warning("reference video is gone on the Gemini side, uploading it again",
+                   extra={"sport": sport, "file": stale.name})
+    # Concurrent requests that hit the same missing file share one upload
+    reference_registry.invalidate(sport, stale.name)
+    return await prepare_reference(reference_registry, context_cache, sport, prompt)
+
+
+def reference_gone(error: BaseException, reference_file) -> bool:
+    # Polling says which file is gone. A 403/404 from generation is blamed on
+    # the reference, since the user's file was seen ACTIVE moments before.
+    if isinstance(error, FileGone):
+        return error.name == reference_file.name
+    return is_file_gone(error)
+
+
+def count_rejection(sport: str, text: str, reason: str = "model"):
+    if text.lstrip().startswith("REJECTED"):
+        REJECTIONS.labels(sport, reason).inc()
+
+
+async def run_analysis(
+    gemini,
+    reference_registry,
+    sport: str,
+    prompt: str,
+    user_path: Path,
+    on_stage: Optional[Callable[[str], None]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    context_cache=None,
+    temp_storage=None,
+) -> str:
+    """Upload, wait for ACTIVE and generate.
+
+    ``on_stage`` is told when the pipeline reaches uploaded/processing/generating,
+    and passing ``on_text`` switches generation to streaming, one call per chunk.
+    """
+    timings = {}
+    started = time.perf_counter()
+    notify = on_stage or (lambda stage: None)
+
+    # Reference video is uploaded once per sport and reused until it expires
+    try:
+        (reference_file, context), user_file = await asyncio.gather(
+            prepare_reference(reference_registry, context_cache, sport, prompt),
+            normalize_and_upload(gemini, user_path, timings, temp_storage),
+        )
+    except NoMotionDetected:
+        text = no_motion_rejection(sport)
+        count_rejection(sport, text, "no_motion")
+        return text
+
+    notify("uploaded")
+
+    emitted = False
+
+    def forward(text: str):
+        nonlocal emitted
+        emitted = True
+        on_text(text)
+
+    # A reference file that disappeared before its expiry is uploaded again
+    # once, unless text has already gone out
+    for retry in (True, False):
+        try:
+            notify("processing")
+            with span("processing_wait", logger, timings):
+                file_state_user, file_state_reference = await wait_for_files(gemini, user_file, reference_file)
+
+            error_msg = file_failure_message(file_state_user, file_state_reference)
+            if error_msg:
+                if file_state_reference.state == "FAILED":
+                    reference_registry.invalidate(sport)
+                raise HTTPException(status_code=500, detail=error_msg)
+
+            notify("generating")
+            with span("generate", logger, timings, sport=sport):
+                text = await generate_with_context(
+                    gemini, context_cache, sport, prompt, user_file, reference_file, context,
+                    forward if on_text else None,
+                )
+            break
+        except Exception as e:
+            if not retry or emitted or not reference_gone(e, reference_file):
+                raise
+            reference_file, context = await replace_reference(
+                reference_registry, context_cache, sport, prompt, reference_file
+            )
+    count_rejection(sport, text)
+    timings["total"] = time.perf_counter() - started
+
+    logger.info("analysis complete", extra={"sport": sport, **{k: round(v, 4) for k, v in timings.items()}})
+    return text
+
+
+@dataclass
+class BatchClip:
+    sport: str
+    prompt: str
+    path: Path
+
+
+@dataclass
+class BatchClipResult:
+    analysis: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.timings.values())
+
+
+def _error_detail(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return error.detail
+    return f"Analysis error: {str(error)}"
+
+
+async def run_batch_analysis(
+    gemini, reference_registry, clips: List[BatchClip], context_cache=None, temp_storage=None
+) -> List[BatchClipResult]:
+    """Analyze several clips together.
+
+    All uploads run concurrently, every file is watched by one shared polling
+    loop, and generations fan out up to BATCH_GENERATE_CONCURRENCY. A failing
+    clip only fails its own result; a reference that fails only fails the
+    clips of its sport.
+    """
+    results = [BatchClipResult() for _ in clips]
+    prompts = {clip.sport: clip.prompt for clip in clips}
+    sports = sorted(prompts)
+
+    reference_results, upload_results = await asyncio.gather(
+        asyncio.gather(
+            *(prepare_reference(reference_registry, context_cache, sport, prompts[sport]) for sport in sports),
+            return_exceptions=True,
+        ),
+        asyncio.gather(
+            *(normalize_and_upload(gemini, clip.path, result.timings, temp_storage)
+              for clip, result in zip(clips, results)),
+            return_exceptions=True,
+        ),
+    )
+    references = dict(zip(sports, reference_results))
+
+    ready = []
+    for index, (clip, uploaded) in enumerate(zip(clips, upload_results)):
+        reference = references[clip.sport]
+        if isinstance(uploaded, NoMotionDetected):
+            results[index].analysis = no_motion_rejection(clip.sport)
+            count_rejection(clip.sport, results[index].analysis, "no_motion")
+        elif isinstance(reference, BaseException):
+            results[index].error = _error_detail(reference)
+        elif isinstance(uploaded, BaseException):
+            results[index].error = _error_detail(uploaded)
+        else:
+            ready.append((index, uploaded, *reference))
+
+    wait_timings = {}
+    failures: Dict[str, BaseException] = {}
+    files = {f.name: f for _, uploaded, reference, _ in ready for f in (uploaded, reference)}
+    with span("processing_wait", logger, wait_timings, files=len(files)):
+        settled = await poll_files(gemini, list(files.values()), errors=failures)
+
+        # References that disappeared before their expiry are uploaded again
+        # once and polled on their own
+        stale = [
+            sport for sport in sports
+            if not isinstance(references[sport], BaseException)
+            and is_file_gone(failures.get(references[sport][0].name))
+        ]
+        if stale:
+            replaced = await asyncio.gather(
+                *(replace_reference(reference_registry, context_cache, sport, prompts[sport], references[sport][0])
+                  for sport in stale),
+                return_exceptions=True,
+            )
+            references.update(zip(stale, replaced))
+            fresh = [references[sport][0] for sport in stale if not isinstance(references[sport], BaseException)]
+            settled.update(await poll_files(gemini, fresh, errors=failures))
+    wait_seconds = wait_timings["processing_wait"]
+
+    generate_slots = asyncio.Semaphore(BATCH_GENERATE_CONCURRENCY)
+
+    async def generate(index, user_file):
+        clip, result = clips[index], results[index]
+        result.timings["processing_wait"] = wait_seconds
+        reference = references[clip.sport]
+        if isinstance(reference, BaseException):
+            result.error = _error_detail(reference)
+            return
+        reference_file, context = reference
+        failure = failures.get(user_file.name) or failures.get(reference_file.name)
+        if failure is not None:
+            result.error = _error_detail(failure)
+            return
+        user_state = settled.get(user_file.name)
+        reference_state = settled.get(reference_file.name)
+        if user_state is None or reference_state is None:
+            result.error = "File processing timeout"
+            return
+        error_msg = file_failure_message(user_state, reference_state)
+        if error_msg:
+            if reference_state.state == "FAILED":
+                reference_registry.invalidate(clip.sport)
+            result.error = error_msg
+            return
+
+        async with generate_slots:
+            try:
+                with span("generate", logger, result.timings, sport=clip.sport):
+                    try:
+                        result.analysis = await generate_with_context(
+                            gemini, context_cache, clip.sport, clip.prompt, user_file, reference_file, context
+                        )
+                    except Exception as e:
+                        if not reference_gone(e, reference_file):
+                            raise
+                        reference_file, context = await replace_reference(
+                            reference_registry, context_cache, clip.sport, clip.prompt, reference_file
+                        )
+                        result.analysis = await generate_with_context(
+                            gemini, context_cache, clip.sport, clip.prompt, user_file, reference_file, context
+                        )
+                count_rejection(clip.sport, result.analysis)
+            except Exception as e:
+                result.error = _error_detail(e)
+
+    await asyncio.gather(*(generate(index, uploaded) for index, uploaded, *_ in ready))
+    return results
@@ -1,11 +1,15 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db, User
+from database import SessionLocal, User
+from observability import AUTH_SECONDS
 import os
 from dotenv import load_dotenv
 
@@ -14,6 +18,11 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Revoking tokens (password change) clears this process's cache only; other
+# workers keep accepting a revoked token until their entry expires, so the
+# TTL is the cross-worker revocation window
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "15"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -27,6 +36,65 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    username: str
+    token_version: int
+
+
+class PrincipalCache:
+    """Bounded LRU of resolved principals, with entries expiring after a TTL.
+
+    Keyed by user id; a cached principal only satisfies tokens carrying the
+    same token version. ``invalidate`` only reaches this process, so in other
+    workers a revoked token stays valid for up to ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, token_version: int) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            if principal.token_version != token_version:
+                return None
+            self._entries.move_to_end(user_id)
+            return principal
+
+    def put(self, principal: Principal):
+        with self._lock:
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+principal_cache = PrincipalCache()
+
+
+def token_claims(user: User) -> dict:
+    return {"sub": user.email, "uid": user.id, "tv": user.token_version or 0}
+
+
+def invalidate_user(user_id: int):
+    principal_cache.invalidate(user_id)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -38,10 +106,37 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
+def _load_principal(user_id: Optional[int], email: Optional[str]) -> Optional[Principal]:
+    db = SessionLocal()
+    try:
+        query = db.query(User)
+        if user_id is not None:
+            user = query.filter(User.id == user_id).first()
+        else:
+            user = query.filter(User.email == email).first()
+        if user is None:
+            return None
+        return Principal(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            token_version=user.token_version or 0,
+        )
+    finally:
+        db.close()
+
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Principal:
+    started = time.perf_counter()
+    source = "invalid"
+    try:
+        principal, source = _resolve_principal(credentials)
+        return principal
+    finally:
+        AUTH_SECONDS.labels(source).observe(time.perf_counter() - started)
+
+
+def _resolve_principal(credentials: HTTPAuthorizationCredentials):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -51,12 +146,31 @@ def get_current_user(
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
+        user_id: Optional[int] = payload.get("uid")
+        token_version: int = payload.get("tv", 0)
         if email is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    # Tokens issued before uid/tv claims existed always go to the database
+    if user_id is not None:
+        principal = principal_cache.get(user_id, token_version)
+        if principal is not None:
+            return principal, "cache"
+
+    principal = _load_principal(user_id, email)
+    if principal is None or principal.token_version != token_version:
         raise credentials_exception
-    return user
+    if user_id is not None:
+        principal_cache.put(principal)
+    return principal, "database"
+
+
+def token_user_id(token: str) -> Optional[int]:
+    """The user id claim of a validly signed token, without checking it is still current."""
+    try:
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("uid")
+    except JWTError:
+        return None
+    return user_id if isinstance(user_id, int) else None
@@ -0,0 +1,158 @@
+"""Cold start of the API: import time, time to live/ready and first analysis.
+
+Imports ``main`` in fresh interpreters to time the import alone, then
+starts the API under uvicorn with GEMINI_FAKE=true and a throwaway SQLite
+database and records, from process launch, when /healthz and /readyz first
+answer 200 and when the first analysis succeeds. The first analysis is
+compared with a second one to show what is still paid on first use.
+
+    python benchmarks/cold_start.py --runs 5 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from load_test import BACKEND_DIR, free_port, multipart, request
+
+POLL_INTERVAL = 0.02
+STARTUP_METRIC = re.compile(r'^shadowsync_startup_seconds\{milestone="(\w+)"\} ([0-9.e+-]+)$', re.MULTILINE)
+
+
+def fake_env(tmp: str, args) -> dict:
+    return {
+        **os.environ,
+        "GEMINI_FAKE": "true",
+        "DATABASE_URL": f"sqlite:///{tmp}/cold_start.db",
+        "TEMP_UPLOADS_DIR": f"{tmp}/uploads",
+        "FAKE_GEMINI_UPLOAD_SECONDS": str(args.upload_seconds),
+        "FAKE_GEMINI_PROCESSING_SECONDS": str(args.processing_seconds),
+        "FAKE_GEMINI_GENERATE_SECONDS": str(args.generate_seconds),
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+def import_seconds(env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def wait_for(port: int, path: str, server: subprocess.Popen, launched: float, timeout: float = 60) -> float:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup:\n{server.stderr.read().decode()}")
+        try:
+            status, _ = request(port, "GET", path, timeout=5)
+            if status == 200:
+                return time.perf_counter() - launched
+        except OSError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"{path} did not answer 200 within {timeout} seconds")
+
+
+def analyze(port: int, auth: dict, sport: str, video: Path, content: bytes) -> float:
+    # A unique suffix keeps the result cache from answering
+    body, headers = multipart("user_video", video.name, content + uuid.uuid4().bytes)
+    started = time.perf_counter()
+    status, response = request(port, "POST", f"/api/analyze-video/{sport}", body, {**auth, **headers})
+    if status != 200:
+        raise RuntimeError(f"Analysis failed: {status} {response[:200]!r}")
+    return time.perf_counter() - started
+
+
+def cold_start(args, content: bytes) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        launched = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=BACKEND_DIR, env=fake_env(tmp, args),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        try:
+            live = wait_for(port, "/healthz", server, launched)
+            ready = wait_for(port, "/readyz", server, launched)
+
+            credentials = {"email": "cold-start@example.com", "username": "cold", "password": "cold-start-password"}
+            status, body = request(port, "POST", "/api/signup", json.dumps(credentials).encode(),
+                                   {"Content-Type": "application/json"})
+            if status != 200:
+                raise RuntimeError(f"Signup failed: {status} {body[:200]!r}")
+            auth = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+            first = analyze(port, auth, args.sport, args.video, content)
+            first_success = time.perf_counter() - launched
+            second = analyze(port, auth, args.sport, args.video, content)
+
+            _, metrics = request(port, "GET", "/metrics")
+            milestones = {name: float(value) for name, value in STARTUP_METRIC.findall(metrics.decode())}
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return {
+        "live_seconds": live,
+        "ready_seconds": ready,
+        "first_analysis_seconds": first,
+        "second_analysis_seconds": second,
+        "time_to_first_analysis_seconds": first_success,
+        "server_milestones": milestones,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--sport", default="golf")
+    parser.add_argument("--video", type=Path, default=BACKEND_DIR / "tigerSwing.mp4", help="clip to upload")
+    parser.add_argument("--upload-seconds", type=float, default=0.05)
+    parser.add_argument("--processing-seconds", type=float, default=0.2)
+    parser.add_argument("--generate-seconds", type=float, default=0.2)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    content = args.video.read_bytes()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = fake_env(tmp, args)
+        imports = [import_seconds(env) for _ in range(args.runs)]
+    runs = [cold_start(args, content) for _ in range(args.runs)]
+
+    summary = {"import_seconds": statistics.median(imports)}
+    for key in runs[0]:
+        if key != "server_milestones":
+            summary[key] = statistics.median(run[key] for run in runs)
+    for key, value in summary.items():
+        print(f"{key:>32}: {value * 1000:8.1f} ms")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_gemini": {
+                "upload_seconds": args.upload_seconds,
+                "processing_seconds": args.processing_seconds,
+                "generate_seconds": args.generate_seconds,
+            },
+            "median": summary,
+            "imports": imports,
+            "runs": runs,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Concurrent write throughput against SQLite, before and after tuning.
+
+"legacy" is the engine as it was originally configured (default rollback
+journal, default pool); "tuned" is database.create_db_engine (WAL,
+synchronous=NORMAL, busy timeout). Each writer thread inserts users one
+commit at a time, like concurrent signups, and does a lookup per write, like
+a login.
+
+    python benchmarks/db_write_throughput.py --threads 16 --writes 200
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import User, create_db_engine, engine_options  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+
+def legacy_engine(url):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+
+def run_sync(label, make_engine, threads, writes):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        db_engine = make_engine(url)
+        run_migrations(db_engine)
+        Session = sessionmaker(bind=db_engine)
+        errors = []
+        lock = threading.Lock()
+
+        def writer(worker):
+            for i in range(writes):
+                db = Session()
+                try:
+                    email = f"user{worker}_{i}@bench.local"
+                    db.add(User(email=email, username=f"user{worker}_{i}", hashed_password="x"))
+                    db.commit()
+                    db.query(User).filter(User.email == email).first()
+                except OperationalError as e:
+                    db.rollback()
+                    with lock:
+                        errors.append(str(e.orig))
+                finally:
+                    db.close()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        db_engine.dispose()
+
+    return _result(label, threads * writes, len(errors), elapsed)
+
+
+def run_async(label, threads, writes):
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        return None
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from database import apply_sqlite_pragmas
+
+    async def main(tmp):
+        url = f"sqlite+aiosqlite:///{tmp}/bench.db"
+        run_migrations(create_db_engine(f"sqlite:///{tmp}/bench.db"))
+        db_engine = create_async_engine(url, **engine_options(url))
+        event.listen(db_engine.sync_engine, "connect", apply_sqlite_pragmas)
+        Session = async_sessionmaker(db_engine, expire_on_commit=False)
+        errors = []
+
+        async def writer(worker):
+            for i in range(writes):
+                async with Session() as db:
+                    try:
+                        db.add(User(email=f"user{worker}_{i}@bench.local", username=f"user{worker}_{i}", hashed_password="x"))
+                        await db.commit()
+                    except OperationalError as e:
+                        await db.rollback()
+                        errors.append(str(e.orig))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(n) for n in range(threads)))
+        elapsed = time.perf_counter() - started
+        await db_engine.dispose()
+        return _result(label, threads * writes, len(errors), elapsed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(main(tmp))
+
+
+def _result(label, attempted, failed, elapsed):
+    return {
+        "engine": label,
+        "attempted_writes": attempted,
+        "failed_writes": failed,
+        "seconds": round(elapsed, 3),
+        "writes_per_second": round((attempted - failed) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [
+        run_sync("legacy", legacy_engine, args.threads, args.writes),
+        run_sync("tuned", create_db_engine, args.threads, args.writes),
+    ]
+    async_result = run_async("tuned-async", args.threads, args.writes)
+    if async_result:
+        results.append(async_result)
+
+    for result in results:
+        print(
+            f"{result['engine']:>12}: {result['writes_per_second']:>8} writes/s, "
+            f"{result['failed_writes']} failed, {result['seconds']}s"
+        )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Load test of the API against the fake Gemini backend.
+
+Starts the API under uvicorn with GEMINI_FAKE=true and a throwaway SQLite
+database, then drives /api/login, /api/me and /api/analyze-video/{sport} at
+a fixed concurrency. Reports throughput, p50/p95/p99 latency and the
+server's peak RSS for each scenario.
+
+    python benchmarks/load_test.py --concurrency 16 --requests 200 --output results.json
+
+Fake Gemini timings are set with --upload-seconds, --processing-seconds,
+--generate-seconds and --fail-rate. Each analysis upload gets a unique
+suffix so that the result cache does not answer it; pass --repeat-video to
+measure cache hits instead.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("login", "me", "analyze")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, tmp: str, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "GEMINI_FAKE": "true",
+        "DATABASE_URL": f"sqlite:///{tmp}/load_test.db",
+        "TEMP_UPLOADS_DIR": f"{tmp}/uploads",
+        "FAKE_GEMINI_UPLOAD_SECONDS": str(args.upload_seconds),
+        "FAKE_GEMINI_PROCESSING_SECONDS": str(args.processing_seconds),
+        "FAKE_GEMINI_GENERATE_SECONDS": str(args.generate_seconds),
+        "FAKE_GEMINI_FAIL_RATE": str(args.fail_rate),
+        # Every request comes from one account; per-user limits would only
+        # measure the rate limiter
+        "ADMISSION_RATE_PER_MINUTE": "0",
+        "ADMISSION_MAX_CONCURRENT_PER_USER": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup:\n{server.stderr.read().decode()}")
+        try:
+            status, _ = request(port, "GET", "/")
+            if status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+def peak_rss_kb(pid: int):
+    # VmHWM is the high-water mark of the resident set; Linux only
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def request(port: int, method: str, path: str, body: bytes = None, headers: dict = None, timeout: float = 300):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def multipart(field: str, filename: str, content: bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: video/mp4\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(name, port, call, requests, concurrency, server_pid):
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            status, _ = call()
+        except OSError:
+            status = None
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds for seconds, _ in samples)
+    errors = sum(1 for _, status in samples if status is None or status >= 400)
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "server_peak_rss_kb": peak_rss_kb(server_pid),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of login,me,analyze")
+    parser.add_argument("--sport", default="golf")
+    parser.add_argument("--video", type=Path, default=BACKEND_DIR / "tigerSwing.mp4", help="clip to upload")
+    parser.add_argument("--repeat-video", action="store_true", help="upload identical bytes every time")
+    parser.add_argument("--upload-seconds", type=float, default=0.2)
+    parser.add_argument("--processing-seconds", type=float, default=1.0)
+    parser.add_argument("--generate-seconds", type=float, default=2.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    video = args.video.read_bytes()
+    port = free_port()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        server = start_server(port, tmp, args)
+        try:
+            credentials = {"email": "load-test@example.com", "username": "load", "password": "load-test-password"}
+            status, body = request(port, "POST", "/api/signup", json.dumps(credentials).encode(),
+                                   {"Content-Type": "application/json"})
+            if status != 200:
+                raise RuntimeError(f"Signup failed: {status} {body[:200]!r}")
+            auth = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+            login_body = json.dumps({"email": credentials["email"], "password": credentials["password"]}).encode()
+
+            def analyze():
+                content = video if args.repeat_video else video + uuid.uuid4().bytes
+                body, headers = multipart("user_video", args.video.name, content)
+                return request(port, "POST", f"/api/analyze-video/{args.sport}", body, {**auth, **headers})
+
+            calls = {
+                "login": lambda: request(port, "POST", "/api/login", login_body, {"Content-Type": "application/json"}),
+                "me": lambda: request(port, "GET", "/api/me", headers=auth),
+                "analyze": analyze,
+            }
+            for name in scenarios:
+                result = run_scenario(name, port, calls[name], args.requests, args.concurrency, server.pid)
+                results.append(result)
+                print(
+                    f"{name:>8}: {result['throughput_rps']:>8} req/s, p50 {result['p50_ms']}ms, "
+                    f"p95 {result['p95_ms']}ms, p99 {result['p99_ms']}ms, {result['errors']} errors, "
+                    f"peak RSS {result['server_peak_rss_kb']} KB"
+                )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_gemini": {
+                "upload_seconds": args.upload_seconds,
+                "processing_seconds": args.processing_seconds,
+                "generate_seconds": args.generate_seconds,
+                "fail_rate": args.fail_rate,
+            },
+            "video": {"path": str(args.video), "bytes": len(video), "unique": not args.repeat_video},
+            "results": results,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from gemini_service import GeminiUnavailable, sdk_types
+from observability import get_logger
+from result_cache import prompt_version
+
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL = timedelta(minutes=int(os.getenv("CONTEXT_CACHE_TTL_MINUTES", "60")))
+# Caches this close to expiry get their TTL extended before being handed out
+CONTEXT_CACHE_REFRESH_MARGIN = timedelta(minutes=5)
+# After a failed build (e.g. the model does not support caching or the
+# context is below its minimum size) requests skip the cache for a while
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedContext:
+    name: str
+    key: str
+    expires_at: datetime
+
+
+def context_key(model: str, prompt: str, reference_hash: str) -> str:
+    raw = "|".join([model, prompt_version(prompt), reference_hash])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SportContextCache:
+    """Per-sport Gemini cached contexts holding the reference clip and prompt.
+
+    With a cached context, generation only sends the user's video; the
+    reference clip and the prompt are billed and prefilled once per cache.
+    A context is rebuilt when the prompt, the reference clip or the model
+    changes, and its TTL is extended while it keeps being used.
+    """
+
+    def __init__(self, gemini, ttl: timedelta = CONTEXT_CACHE_TTL, enabled: bool = GEMINI_CONTEXT_CACHE):
+        self.gemini = gemini
+        self.model = gemini.model
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: Dict[str, CachedContext] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._failed_until: Dict[str, float] = {}
+
+    async def get(self, sport: str, prompt: str, reference) -> Optional[CachedContext]:
+        """Returns the sport's cached context, or None to generate without one."""
+        if not self.enabled:
+            return None
+        key = context_key(self.model, prompt, reference.source_hash)
+        if self._failed_until.get(key, 0) > time.monotonic():
+            return None
+
+        entry = self._entries.get(sport)
+        if entry and entry.key == key and entry.expires_at - CONTEXT_CACHE_REFRESH_MARGIN > datetime.utcnow():
+            return entry
+
+        task = self._inflight.get(sport)
+        if task is None:
+            task = asyncio.create_task(self._refresh(sport, key, prompt, reference))
+            self._inflight[sport] = task
+            task.add_done_callback(lambda done: self._forget_inflight(sport, done))
+        return await asyncio.shield(task)
+
+    def invalidate(self, sport: str):
+        self._entries.pop(sport, None)
+
+    def _forget_inflight(self, sport: str, task: asyncio.Task):
+        if self._inflight.get(sport) is task:
+            del self._inflight[sport]
+
+    async def _refresh(self, sport: str, key: str, prompt: str, reference) -> Optional[CachedContext]:
+        entry = self._entries.get(sport)
+        if entry and entry.key == key:
+            try:
+                entry = await self._extend(entry)
+                self._entries[sport] = entry
+                return entry
+            except Exception as e:
+                # Most likely expired on the Gemini side already; build a new one
+                logger.warning("could not extend context cache", extra={"context_cache": entry.name, "error": str(e)})
+        elif entry:
+            await self._delete(entry)
+
+        try:
+            entry = await self._create(sport, key, prompt, reference)
+        except GeminiUnavailable:
+            # Says nothing about whether this context can be cached
+            raise
+        except Exception as e:
+            logger.warning("could not build context cache, generating without it", extra={"sport": sport, "error": str(e)})
+            self._entries.pop(sport, None)
+            self._failed_until[key] = time.monotonic() + CONTEXT_CACHE_RETRY_SECONDS
+            return None
+        self._entries[sport] = entry
+        return entry
+
+    async def _create(self, sport: str, key: str, prompt: str, reference) -> CachedContext:
+        started = time.perf_counter()
+        types = sdk_types()
+        cached = await self.gemini.create_cache(
+            contents=[types.Content(role="user", parts=[
+                types.Part.from_text("Reference video:"),
+                types.Part.from_uri(file_uri=reference.uri, mime_type=reference.mime_type),
+            ])],
+            config={
+                "display_name": f"shadowsync-{sport}-{key[:12]}",
+                "system_instruction": prompt,
+                "ttl": f"{int(self.ttl.total_seconds())}s",
+            },
+        )
+        usage = getattr(cached, "usage_metadata", None)
+        tokens = getattr(usage, "total_token_count", None)
+        logger.info("built context cache", extra={
+            "sport": sport,
+            "context_cache": cached.name,
+            "tokens": tokens,
+            "seconds": round(time.perf_counter() - started, 4),
+        })
+        return CachedContext(name=cached.name, key=key, expires_at=datetime.utcnow() + self.ttl)
+
+    async def _extend(self, entry: CachedContext) -> CachedContext:
+        await self.gemini.update_cache(entry.name, {"ttl": f"{int(self.ttl.total_seconds())}s"})
+        return CachedContext(name=entry.name, key=entry.key, expires_at=datetime.utcnow() + self.ttl)
+
+    async def _delete(self, entry: CachedContext):
+        try:
+            await self.gemini.delete_cache(entry.name)
+        except Exception as e:
+            logger.warning("could not delete context cache", extra={"context_cache": entry.name, "error": str(e)})
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import create_engine, event, text, Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -7,11 +8,76 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./shadowsync.db")
+# Set to e.g. sqlite+aiosqlite:///./shadowsync.db or postgresql+asyncpg://...
+# to enable the async engine behind get_async_db. It is opt-in: no endpoint
+# uses it yet (see benchmarks/db_write_throughput.py for its numbers), and
+# only aiosqlite is in requirements.txt.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Connection pool settings, used for server databases such as Postgres
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite tuning: WAL lets readers run alongside the single writer, and the
+# busy timeout makes writers queue for the lock instead of failing with
+# "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> dict:
+    if _is_sqlite(url):
+        return {
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+            },
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL):
+    db_engine = create_engine(url, **engine_options(url))
+    if _is_sqlite(url):
+        event.listen(db_engine, "connect", apply_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DATABASE_URL:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+    if _is_sqlite(ASYNC_DATABASE_URL):
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -20,6 +86,87 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+    # Bumped to revoke every token issued before (e.g. on password change)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class ReferenceFile(Base):
+    __tablename__ = "reference_files"
+
+    sport = Column(String, primary_key=True)
+    file_name = Column(String)
+    file_uri = Column(String)
+    mime_type = Column(String)
+    source_hash = Column(String)
+    uploaded_at = Column(DateTime)
+    expires_at = Column(DateTime)
+
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    sport = Column(String)
+    status = Column(String, index=True)
+    video_path = Column(String)
+    content_hash = Column(String, nullable=True)
+    result = Column(Text, nullable=True)
+    cached = Column(Boolean, default=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+
+    key = Column(String, primary_key=True)
+    sport = Column(String)
+    analysis = Column(Text)
+    created_at = Column(DateTime, index=True)
+    last_used_at = Column(DateTime, index=True)
+    hits = Column(Integer, default=0)
+
+
+class Analysis(Base):
+    __tablename__ = "analyses"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    sport = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    similarity_score = Column(Integer, nullable=True)
+    analysis = Column(Text)
+    content_hash = Column(String, nullable=True)
+
+    # Both indexes end in (created_at, id) so keyset pages are index range scans
+    __table_args__ = (
+        Index("ix_analyses_user_created", "user_id", "created_at", "id"),
+        Index("ix_analyses_user_sport", "user_id", "sport", "created_at", "id"),
+        # One row per clip per sport; rows without a hash never collide
+        Index("ux_analyses_user_sport_hash", "user_id", "sport", "content_hash", unique=True),
+    )
+
+
+class UserSportStats(Base):
+    """Per-user, per-sport aggregates kept up to date as analyses are saved."""
+    __tablename__ = "user_sport_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    sport = Column(String, primary_key=True)
+    analysis_count = Column(Integer, nullable=False, default=0)
+    scored_count = Column(Integer, nullable=False, default=0)
+    score_total = Column(Integer, nullable=False, default=0)
+    best_score = Column(Integer, nullable=True)
+    last_score = Column(Integer, nullable=True)
+    last_analysis_at = Column(DateTime, nullable=True)
+
+
+def ping(db_engine=None):
+    """Round-trips a trivial query; raises if the database is unreachable."""
+    with (db_engine or engine).connect() as conn:
+        conn.execute(text("SELECT 1"))
 
 
 def get_db():
@@ -30,5 +177,8 @@ def get_db():
         db.close()
 
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("ASYNC_DATABASE_URL is not configured")
+    async with AsyncSessionLocal() as db:
+        yield db
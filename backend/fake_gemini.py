@@ -0,0 +1,215 @@
+"""In-process stand-in for ``genai.Client`` used for load tests and local runs.
+
+Set GEMINI_FAKE=true to make the API use it instead of the real client. It
+simulates upload time, the PROCESSING -> ACTIVE transition, FAILED files and
+generation delay, all configurable through FAKE_GEMINI_* variables, so the
+pipeline can be benchmarked without spending Gemini quota.
+"""
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+@dataclass
+class FakeGeminiConfig:
+    upload_seconds: float = 0.2
+    upload_mb_per_second: float = 50.0
+    processing_seconds: float = 1.0
+    fail_rate: float = 0.0
+    generate_seconds: float = 2.0
+    stream_chunks: int = 8
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiConfig":
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        return cls(
+            upload_seconds=_env_float("FAKE_GEMINI_UPLOAD_SECONDS", cls.upload_seconds),
+            upload_mb_per_second=_env_float("FAKE_GEMINI_UPLOAD_MB_PER_SECOND", cls.upload_mb_per_second),
+            processing_seconds=_env_float("FAKE_GEMINI_PROCESSING_SECONDS", cls.processing_seconds),
+            fail_rate=_env_float("FAKE_GEMINI_FAIL_RATE", cls.fail_rate),
+            generate_seconds=_env_float("FAKE_GEMINI_GENERATE_SECONDS", cls.generate_seconds),
+            stream_chunks=int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", str(cls.stream_chunks))),
+            seed=int(seed) if seed else None,
+        )
+
+
+@dataclass
+class FakeFile:
+    name: str
+    uri: str
+    mime_type: str
+    size_bytes: int
+    state: str
+    expiration_time: datetime
+    error: Optional[str] = None
+
+
+@dataclass
+class FakeUsage:
+    prompt_token_count: int
+    cached_content_token_count: Optional[int]
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class FakeResponse:
+    text: str
+    usage_metadata: Optional[FakeUsage] = None
+
+
+@dataclass
+class FakeCachedContent:
+    name: str
+    usage_metadata: FakeUsage
+
+
+@dataclass
+class _StoredFile:
+    file: FakeFile
+    ready_at: float
+    fails: bool
+
+
+@dataclass
+class _Backend:
+    config: FakeGeminiConfig
+    files: Dict[str, _StoredFile] = field(default_factory=dict)
+    caches: Dict[str, FakeCachedContent] = field(default_factory=dict)
+    ids: itertools.count = field(default_factory=itertools.count)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self.random = random.Random(self.config.seed)
+
+    def upload(self, path: str) -> FakeFile:
+        size = os.path.getsize(path)
+        with self.lock:
+            file_id = next(self.ids)
+            fails = self.random.random() < self.config.fail_rate
+        name = f"files/fake-{file_id}"
+        file = FakeFile(
+            name=name,
+            uri=f"https://fake-gemini.local/v1beta/{name}",
+            mime_type="video/mp4",
+            size_bytes=size,
+            state="PROCESSING",
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+        )
+        self.files[name] = _StoredFile(file, time.monotonic() + self.config.processing_seconds, fails)
+        return file
+
+    def upload_delay(self, path: str) -> float:
+        megabytes = os.path.getsize(path) / (1024 * 1024)
+        return self.config.upload_seconds + megabytes / self.config.upload_mb_per_second
+
+    def get(self, name: str) -> FakeFile:
+        stored = self.files.get(name)
+        if stored is None:
+            raise FileNotFoundError(f"{name} not found")
+        if stored.file.state == "PROCESSING" and time.monotonic() >= stored.ready_at:
+            if stored.fails:
+                stored.file.state = "FAILED"
+                stored.file.error = "Simulated processing failure"
+            else:
+                stored.file.state = "ACTIVE"
+        return stored.file
+
+    def answer(self, cached: bool) -> FakeResponse:
+        with self.lock:
+            score = self.random.randint(40, 95)
+        text = (
+            f"SIMILARITY SCORE: {score}%\n\n"
+            "Strengths: balanced stance and a smooth follow-through.\n"
+            "Differences: the release happens slightly early.\n"
+            "Improvements: hold the finish and keep the head still."
+        )
+        usage = FakeUsage(
+            prompt_token_count=9000,
+            cached_content_token_count=8000 if cached else None,
+            candidates_token_count=len(text) // 4,
+            total_token_count=9000 + len(text) // 4,
+        )
+        return FakeResponse(text=text, usage_metadata=usage)
+
+
+class _AsyncFiles:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    async def upload(self, path: str) -> FakeFile:
+        await asyncio.sleep(self._backend.upload_delay(path))
+        return self._backend.upload(path)
+
+    async def get(self, name: str) -> FakeFile:
+        await asyncio.sleep(0.01)
+        return self._backend.get(name)
+
+
+class _AsyncModels:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    async def generate_content(self, model: str, contents: List, config=None) -> FakeResponse:
+        await asyncio.sleep(self._backend.config.generate_seconds)
+        return self._backend.answer(cached=getattr(config, "cached_content", None) is not None)
+
+
+class _Models:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    def generate_content_stream(self, model: str, contents: List, config=None):
+        response = self._backend.answer(cached=getattr(config, "cached_content", None) is not None)
+        chunks = max(1, self._backend.config.stream_chunks)
+        step = -(-len(response.text) // chunks)
+        for start in range(0, len(response.text), step):
+            time.sleep(self._backend.config.generate_seconds / chunks)
+            last = start + step >= len(response.text)
+            yield FakeResponse(response.text[start:start + step], response.usage_metadata if last else None)
+
+
+class _AsyncCaches:
+    def __init__(self, backend: _Backend):
+        self._backend = backend
+
+    async def create(self, model: str, contents: List, config=None) -> FakeCachedContent:
+        await asyncio.sleep(self._backend.config.upload_seconds)
+        name = f"cachedContents/fake-{next(self._backend.ids)}"
+        cached = FakeCachedContent(name, FakeUsage(8000, None, 0, 8000))
+        self._backend.caches[name] = cached
+        return cached
+
+    async def update(self, name: str, config=None) -> FakeCachedContent:
+        return self._backend.caches[name]
+
+    async def delete(self, name: str):
+        self._backend.caches.pop(name, None)
+
+
+class _Aio:
+    def __init__(self, backend: _Backend):
+        self.files = _AsyncFiles(backend)
+        self.models = _AsyncModels(backend)
+        self.caches = _AsyncCaches(backend)
+
+
+class FakeGeminiClient:
+    """Implements the slice of ``genai.Client`` that the API uses."""
+
+    def __init__(self, config: Optional[FakeGeminiConfig] = None):
+        self.config = config or FakeGeminiConfig.from_env()
+        backend = _Backend(self.config)
+        self.aio = _Aio(backend)
+        self.models = _Models(backend)
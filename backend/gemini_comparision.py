@@ -1,19 +1,33 @@
 
-import os
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
-import time
 
-# Load environment variables
+# Load environment variables before the service reads its configuration
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
 
-app = FastAPI()
-client = genai.Client(api_key=api_key)
+from analysis import run_analysis
+from gemini_service import GeminiService, gemini_configured
+from migrations import run_migrations, DB_AUTO_MIGRATE
+from reference_files import ReferenceFileRegistry
+from temp_storage import TempStorage
+from uploads import receive_form
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # The reference registry persists uploads in tables the migrations create
+    if DB_AUTO_MIGRATE:
+        await asyncio.to_thread(run_migrations)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+# Same client, timeouts, retries and model as the main API
+gemini = GeminiService() if gemini_configured() else None
 
 # Get the base directory of the project
 BASE_DIR = Path(__file__).resolve().parent
@@ -26,6 +40,8 @@ TEMP_UPLOADS_DIR = BASE_DIR / "temp_uploads"
 REFERENCE_VIDEOS_DIR.mkdir(exist_ok=True)
 TEMP_UPLOADS_DIR.mkdir(exist_ok=True)
 
+temp_storage = TempStorage(TEMP_UPLOADS_DIR)
+
 SPORT_PROMPTS = {
     "basketball": (
         "Describe the basketball shooting form compared to the player in the video on the Golden State Warriors "
@@ -66,8 +82,13 @@ SPORT_VIDEOS = {
 }
 
 
+reference_registry = ReferenceFileRegistry(gemini, SPORT_VIDEOS) if gemini else None
+
+
 @app.post("/analyze-video/{sport}") 
-async def analyze_video(sport: str, user_video: UploadFile = File(...)):
+async def analyze_video(sport: str, request: Request):
+    if not gemini:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured.")
     if sport not in SPORT_PROMPTS:
         raise HTTPException(status_code=400, detail="Unsupported sport.")
     
@@ -80,41 +101,15 @@ async def analyze_video(sport: str, user_video: UploadFile = File(...)):
             detail=f"Reference video for {sport} not found. Please ensure {reference_path.name} is in the reference_videos directory."
         )
     
-    # Upload reference video
-    referenceFile = client.files.upload(file=str(reference_path))
     prompt = SPORT_PROMPTS[sport]
     
-    # Save uploaded user video temporarily
-    user_path = TEMP_UPLOADS_DIR / f"temp_{user_video.filename}"
-    with open(user_path, "wb") as f:
-        f.write(await user_video.read())
-    
-    myfile = client.files.upload(file=str(user_path))
-    print(f"User file state: {myfile.state}, Reference file state: {referenceFile.state}")
+    # The user video is written straight to a temp file and removed afterwards
+    form = await receive_form(request, lambda filename: temp_storage.open(None, filename, prefix="temp"), required=("user_video",))
     
-    # Wait for both files to be processed
-    while True:
-        file_state_user = client.files.get(name=myfile.name)
-        file_state_reference = client.files.get(name=referenceFile.name)
-
-        if file_state_user.state == "ACTIVE" and file_state_reference.state == "ACTIVE":
-            break
-        elif file_state_user.state == "FAILED" or file_state_reference.state == "FAILED":
-            raise RuntimeError(
-                f"File processing failed: User={file_state_user.error}, Reference={file_state_reference.error}"
-            )
-        time.sleep(1)
-
-    # Generate analysis
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[prompt, myfile, referenceFile],
-    )
-    
-    # Clean up the temporary file
-    try:
-        os.remove(user_path)
-    except Exception as e:
-        print(f"Warning: Could not remove temp file {user_path}: {e}")
+    # Upload, bounded wait for ACTIVE and generation all go through the shared pipeline
+    with form:
+        analysis = await run_analysis(
+            gemini, reference_registry, sport, prompt, form.file("user_video").temp.path, temp_storage=temp_storage
+        )
     
-    return JSONResponse(content={"sport": sport, "response": response.text})
\ No newline at end of file
+    return JSONResponse(content={"sport": sport, "response": analysis})
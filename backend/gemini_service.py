@@ -0,0 +1,385 @@
+"""Single entry point for every Gemini call the backend makes.
+
+Wraps the SDK client with a pooled HTTP transport, per-call timeouts,
+jittered exponential retry on transient errors (429 and 5xx) and a circuit
+breaker that fails fast while the upstream keeps failing. The model used for
+generation and context caches is chosen here via GEMINI_MODEL.
+
+The SDK itself is imported lazily: ``google.genai`` takes about half a
+second to import, so it is loaded by ``GeminiService.warm_up`` in the
+background instead of when the app module is imported.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+
+from observability import GEMINI_CIRCUIT_OPEN, GEMINI_RETRIES, get_logger, record_gemini_error
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+
+# Per-call limits. Metadata calls (file state, cache updates) are quick;
+# uploads and generations get more room. Streams time out when no chunk
+# arrives for GEMINI_GENERATE_TIMEOUT_SECONDS.
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_UPLOAD_TIMEOUT_SECONDS = float(os.getenv("GEMINI_UPLOAD_TIMEOUT_SECONDS", "300"))
+GEMINI_GENERATE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_GENERATE_TIMEOUT_SECONDS", "120"))
+
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+
+# Consecutive transient failures that open the breaker, and how long it
+# stays open before a single probe call is let through
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "16"))
+GEMINI_CONNECT_TIMEOUT_SECONDS = 10
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = get_logger(__name__)
+
+
+def sdk_types():
+    """``google.genai.types``, imported on first use."""
+    from google.genai import types
+    return types
+
+
+def sdk_errors():
+    """``google.genai.errors``, imported on first use."""
+    from google.genai import errors
+    return errors
+
+
+def fake_enabled() -> bool:
+    return os.getenv("GEMINI_FAKE", "false").lower() in ("1", "true", "yes")
+
+
+def gemini_configured() -> bool:
+    """Whether create_client() will return a client, without importing the SDK."""
+    return fake_enabled() or bool(os.getenv("GEMINI_API_KEY"))
+
+
+class GeminiUnavailable(HTTPException):
+    """Raised without calling Gemini while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="The analysis service is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.5)))},
+        )
+
+
+def create_client():
+    """Builds the Gemini client from the environment, or None without an API key.
+
+    GEMINI_FAKE=true swaps in the simulated backend from fake_gemini.py.
+    """
+    if fake_enabled():
+        from fake_gemini import FakeGeminiClient
+        return FakeGeminiClient()
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    from google import genai
+    client = genai.Client(api_key=api_key)
+    _install_pooled_transport(client)
+    return client
+
+
+def _install_pooled_transport(client):
+    # google-genai 0.2.1 opens a fresh requests.Session (and TLS connection)
+    # for every call and sends it without a timeout. Route its requests
+    # through one pooled session with a read timeout instead, so a stalled
+    # connection cannot hold a worker thread forever.
+    import requests
+    from google.genai._api_client import HttpResponse, RequestJsonEncoder
+
+    APIError = sdk_errors().APIError
+    api_client = client._api_client
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=GEMINI_POOL_SIZE)
+    session.mount("https://", adapter)
+    read_timeout = max(GEMINI_UPLOAD_TIMEOUT_SECONDS, GEMINI_GENERATE_TIMEOUT_SECONDS)
+
+    def request_unauthorized(http_request, stream: bool = False):
+        data = http_request.data
+        if data and not isinstance(data, bytes):
+            data = json.dumps(data, cls=RequestJsonEncoder)
+        response = session.request(
+            http_request.method,
+            http_request.url,
+            headers=http_request.headers,
+            data=data or None,
+            stream=stream,
+            timeout=(GEMINI_CONNECT_TIMEOUT_SECONDS, read_timeout),
+        )
+        APIError.raise_for_response(response)
+        return HttpResponse(response.headers, response if stream else [response.text])
+
+    api_client._request_unauthorized = request_unauthorized
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    # Only reached after a call failed, by which time the SDK is loaded
+    import requests
+
+    if isinstance(error, sdk_errors().APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    # Full jitter keeps retries from many requests from landing together
+    delay = random.uniform(0, min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** attempt))
+    hinted = _retry_after(error) if error is not None else None
+    if hinted is not None:
+        delay = max(delay, min(hinted, GEMINI_RETRY_MAX_DELAY))
+    return delay
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive transient failures.
+
+    While open every call fails immediately; after ``cooldown`` seconds one
+    probe call is allowed, and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, cooldown: float = GEMINI_BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        raise GeminiUnavailable(max(0.0, self.opened_at + self.cooldown - time.monotonic()))
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("gemini circuit closed")
+            GEMINI_CIRCUIT_OPEN.set(0)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning("gemini circuit opened", extra={"failures": self.failures, "cooldown": self.cooldown})
+            self.opened_at = time.monotonic()
+            self._probing = False
+            GEMINI_CIRCUIT_OPEN.set(1)
+
+    def release_probe(self):
+        # A probe that failed for a non-transient reason (or was cancelled)
+        # says nothing about the upstream; let the next call probe again
+        self._probing = False
+
+
+class GeminiService:
+    """The Gemini calls used by the pipeline, each with timeout, retry and breaker.
+
+    Without a ``client`` one is built from the environment by ``warm_up``,
+    which every call awaits first.
+    """
+
+    def __init__(self, client=None, model: str = GEMINI_MODEL, breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.model = model
+        self.breaker = breaker or CircuitBreaker()
+        self._warming: Optional[asyncio.Future] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.client is not None
+
+    async def warm_up(self):
+        """Imports the SDK and builds the client off the event loop, once."""
+        if self.client is not None:
+            return
+        if self._warming is None:
+            self._warming = asyncio.ensure_future(asyncio.to_thread(self._build_client))
+            self._warming.add_done_callback(self._forget_failed_warm_up)
+        await asyncio.shield(self._warming)
+
+    def _forget_failed_warm_up(self, future: asyncio.Future):
+        # Lets the next call try again
+        if future.cancelled() or future.exception() is not None:
+            self._warming = None
+
+    def _build_client(self):
+        started = time.perf_counter()
+        client = create_client()
+        if client is None:
+            raise RuntimeError("GEMINI_API_KEY is not set")
+        # Request building needs the types module; load it now rather than
+        # on the first analysis
+        sdk_types()
+        self.client = client
+        logger.info("gemini client ready", extra={"seconds": round(time.perf_counter() - started, 4)})
+
+    def _retry_delay(self, operation: str, error: Exception, attempt: int, retryable: bool = True) -> Optional[float]:
+        """Records a failed attempt; returns the delay before the next one, or None to give up."""
+        record_gemini_error(operation, error)
+        if not retryable or not is_retryable(error):
+            self.breaker.release_probe()
+            return None
+        self.breaker.record_failure()
+        if attempt >= GEMINI_MAX_RETRIES:
+            return None
+        delay = backoff_delay(attempt, error)
+        GEMINI_RETRIES.labels(operation).inc()
+        logger.warning("retrying gemini call", extra={
+            "operation": operation, "attempt": attempt + 1, "delay": round(delay, 3),
+            "error": str(error) or type(error).__name__,
+        })
+        return delay
+
+    async def _call(self, operation: str, timeout: float, make_call):
+        await self.warm_up()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await asyncio.wait_for(make_call(), timeout)
+            except Exception as e:
+                delay = self._retry_delay(operation, e, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def upload_file(self, path: Path):
+        return await self._call(
+            "upload", GEMINI_UPLOAD_TIMEOUT_SECONDS,
+            lambda: self.client.aio.files.upload(path=str(path)),
+        )
+
+    async def get_file(self, name: str):
+        return await self._call(
+            "get_file", GEMINI_TIMEOUT_SECONDS,
+            lambda: self.client.aio.files.get(name=name),
+        )
+
+    async def generate(self, contents, config=None):
+        return await self._call(
+            "generate", GEMINI_GENERATE_TIMEOUT_SECONDS,
+            lambda: self.client.aio.models.generate_content(model=self.model, contents=contents, config=config),
+        )
+
+    async def generate_stream(self, contents, config=None, usage: Optional[dict] = None):
+        """Yields text chunks as they arrive; ``usage`` receives the usage metadata.
+
+        Failures before the first chunk are retried like any other call. Once
+        text has been yielded the error is raised, since it cannot be unsent.
+        """
+        await self.warm_up()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            emitted = False
+            try:
+                async for text in self._stream_once(contents, config, usage if usage is not None else {}):
+                    emitted = True
+                    yield text
+            except Exception as e:
+                delay = self._retry_delay("generate_stream", e, attempt, retryable=not emitted)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            else:
+                self.breaker.record_success()
+                return
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _stream_once(self, contents, config, usage: dict):
+        # The SDK's async streaming reads the HTTP response on the event loop, so
+        # the sync stream is drained in a worker thread and handed over via a queue
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        def pump():
+            try:
+                for chunk in self.client.models.generate_content_stream(model=self.model, contents=contents, config=config):
+                    if chunk.usage_metadata is not None:
+                        usage["metadata"] = chunk.usage_metadata
+                    if chunk.text:
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        pumping = loop.run_in_executor(None, pump)
+        while True:
+            item = await asyncio.wait_for(queue.get(), GEMINI_GENERATE_TIMEOUT_SECONDS)
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await pumping
+
+    async def create_cache(self, contents, config):
+        return await self._call(
+            "create_cache", GEMINI_UPLOAD_TIMEOUT_SECONDS,
+            lambda: self.client.aio.caches.create(model=self.model, contents=contents, config=config),
+        )
+
+    async def update_cache(self, name: str, config):
+        return await self._call(
+            "update_cache", GEMINI_TIMEOUT_SECONDS,
+            lambda: self.client.aio.caches.update(name=name, config=config),
+        )
+
+    async def delete_cache(self, name: str):
+        return await self._call(
+            "delete_cache", GEMINI_TIMEOUT_SECONDS,
+            lambda: self.client.aio.caches.delete(name=name),
+        )
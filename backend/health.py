@@ -0,0 +1,39 @@
+"""Liveness and readiness state for the orchestrator probes.
+
+``/healthz`` only says the process is serving requests. ``/readyz`` says
+whether this instance should receive traffic: the background warm-up has
+finished, the database answers and the Gemini client has been built.
+"""
+import asyncio
+from typing import Dict, Tuple
+
+from database import ping
+
+READINESS_DB_TIMEOUT_SECONDS = 2
+
+
+class Readiness:
+    def __init__(self):
+        self.warmed_up = False
+        self.errors: Dict[str, str] = {}
+
+    def fail(self, step: str, error: BaseException):
+        self.errors[step] = str(error) or type(error).__name__
+
+    async def check(self, gemini=None) -> Tuple[bool, Dict[str, object]]:
+        checks: Dict[str, object] = {"warm_up": self.warmed_up and not self.errors}
+        checks["database"] = await _database_reachable()
+        if gemini is not None:
+            checks["gemini"] = gemini.ready
+        ready = all(checks.values())
+        if self.errors:
+            checks["errors"] = dict(self.errors)
+        return ready, checks
+
+
+async def _database_reachable(timeout: float = READINESS_DB_TIMEOUT_SECONDS) -> bool:
+    try:
+        await asyncio.wait_for(asyncio.to_thread(ping), timeout)
+    except Exception:
+        return False
+    return True
@@ -0,0 +1,164 @@
+import base64
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Analysis, UserSportStats
+
+MAX_PAGE_SIZE = 100
+
+DIALECT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# Same patterns, in the same order, as extractSimilarityScore in Home.tsx
+SCORE_PATTERNS = [
+    re.compile(r"similarity\s*score[:\s-]*(\d+)\s*%", re.IGNORECASE),
+    re.compile(r"similarity[:\s-]*(\d+)\s*%", re.IGNORECASE),
+    re.compile(r"(\d+)\s*%\s*similarity", re.IGNORECASE),
+    re.compile(r"\bscore[:\s-]*(\d+)\s*%", re.IGNORECASE),
+    re.compile(r"overall[:\s-]*(\d+)\s*%", re.IGNORECASE),
+    re.compile(r"match[:\s-]*(\d+)\s*%", re.IGNORECASE),
+    re.compile(r"(\d+)\s*%"),
+]
+
+
+def extract_similarity_score(text: str) -> Optional[int]:
+    for pattern in SCORE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            score = int(match.group(1))
+            if 0 <= score <= 100:
+                return score
+    return None
+
+
+def _insert(db: Session):
+    """The dialect's INSERT, which supports ON CONFLICT on SQLite and PostgreSQL."""
+    dialect = db.get_bind().dialect.name
+    if dialect not in DIALECT_INSERTS:
+        raise RuntimeError(f"Saving analyses needs ON CONFLICT support, which {dialect} lacks")
+    return DIALECT_INSERTS[dialect]
+
+
+def save_analysis(user_id: int, sport: str, text: str, content_hash: Optional[str]) -> Optional[int]:
+    """Store an analysis and fold it into the user's per-sport aggregates.
+
+    Rejected videos are not history, and re-submitting the same clip for the
+    same sport does not add a second row. Both writes are single statements
+    that resolve conflicts in the database, so concurrent saves neither
+    duplicate rows nor lose aggregate updates.
+    """
+    if text.lstrip().startswith("REJECTED"):
+        return None
+
+    now = datetime.utcnow()
+    score = extract_similarity_score(text)
+    db = SessionLocal()
+    try:
+        insert = _insert(db)
+        row = insert(Analysis).values(
+            user_id=user_id,
+            sport=sport,
+            created_at=now,
+            similarity_score=score,
+            analysis=text,
+            content_hash=content_hash,
+        ).on_conflict_do_nothing(index_elements=["user_id", "sport", "content_hash"])
+        analysis_id = db.execute(row.returning(Analysis.id)).scalar()
+        if analysis_id is None:
+            # This clip is already saved; its analysis is already counted
+            db.rollback()
+            return db.query(Analysis.id).filter(
+                Analysis.user_id == user_id,
+                Analysis.sport == sport,
+                Analysis.content_hash == content_hash,
+            ).scalar()
+
+        scored = 0 if score is None else 1
+        stats = insert(UserSportStats).values(
+            user_id=user_id,
+            sport=sport,
+            analysis_count=1,
+            scored_count=scored,
+            score_total=score or 0,
+            best_score=score,
+            last_score=score,
+            last_analysis_at=now,
+        )
+        increments = {
+            "analysis_count": UserSportStats.analysis_count + 1,
+            "last_analysis_at": now,
+        }
+        if score is not None:
+            increments.update(
+                scored_count=UserSportStats.scored_count + 1,
+                score_total=UserSportStats.score_total + score,
+                last_score=score,
+                best_score=case(
+                    (or_(UserSportStats.best_score.is_(None), UserSportStats.best_score < score), score),
+                    else_=UserSportStats.best_score,
+                ),
+            )
+        db.execute(stats.on_conflict_do_update(index_elements=["user_id", "sport"], set_=increments))
+        db.commit()
+        return analysis_id
+    finally:
+        db.close()
+
+
+def encode_cursor(created_at: datetime, analysis_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{analysis_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, analysis_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(analysis_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def list_analyses(
+    db: Session,
+    user_id: int,
+    sport: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> Tuple[List[Analysis], Optional[str]]:
+    """Newest-first page of a user's analyses using keyset pagination.
+
+    The cursor is the (created_at, id) of the last row on the previous page,
+    so each page costs the same however deep the client has scrolled.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.query(Analysis).filter(Analysis.user_id == user_id)
+    if sport:
+        query = query.filter(Analysis.sport == sport)
+    if cursor:
+        created_at, analysis_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Analysis.created_at < created_at,
+            and_(Analysis.created_at == created_at, Analysis.id < analysis_id),
+        ))
+
+    rows = query.order_by(Analysis.created_at.desc(), Analysis.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def progress_summary(db: Session, user_id: int) -> List[UserSportStats]:
+    return (
+        db.query(UserSportStats)
+        .filter(UserSportStats.user_id == user_id)
+        .order_by(UserSportStats.sport)
+        .all()
+    )
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import SessionLocal, AnalysisJob
+from observability import get_logger, request_id_var
+
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "4"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+logger = get_logger(__name__)
+
+
+class JobQueue:
+    """Runs analysis jobs on a pool of asyncio workers.
+
+    Job state lives in the ``analysis_jobs`` table, so jobs that were queued or
+    running when the server stopped are picked up again on the next start.
+    A job submitted with an admission (see admission.py) holds it until it
+    finishes.
+    """
+
+    def __init__(self, runner: Callable[[AnalysisJob], Awaitable[Tuple[str, bool]]], storage, workers: int = ANALYSIS_JOB_WORKERS):
+        self.runner = runner
+        self.storage = storage
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._changed: Dict[str, "_JobEvent"] = {}
+        self._admissions: Dict[str, object] = {}
+        self._tasks = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        for job_id, user_id, video_path in await asyncio.to_thread(_requeue_unfinished):
+            logger.info("resuming analysis job", extra={"job_id": job_id})
+            # Keeps the temp janitor away from videos of jobs still to run
+            self.storage.adopt(video_path, user_id)
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        job_id: str,
+        user_id: int,
+        sport: str,
+        video_path: str,
+        content_hash: Optional[str] = None,
+        admission=None,
+    ) -> AnalysisJob:
+        job = await asyncio.to_thread(_create_job, job_id, user_id, sport, video_path, content_hash)
+        if admission is not None:
+            self._admissions[job.id] = admission
+        self._queue.put_nowait(job.id)
+        # Links the submitting request's id to the job id its logs will carry
+        logger.info("queued analysis job", extra={"job_id": job.id, "sport": sport})
+        return job
+
+    async def get(self, job_id: str, user_id: int) -> AnalysisJob:
+        job = await asyncio.to_thread(_load_job, job_id)
+        if job is None or job.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    async def wait(self, job_id: str, user_id: int, timeout: float) -> AnalysisJob:
+        # Grab the change event before reading so an update in between is not
+        # missed. It only lives while someone is waiting on it, so polls of
+        # finished jobs and of unknown ids leave nothing behind.
+        changed = self._event_for(job_id)
+        changed.waiters += 1
+        try:
+            job = await self.get(job_id, user_id)
+            if job.status in FINISHED_STATES:
+                return job
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return job
+        finally:
+            changed.waiters -= 1
+            if not changed.waiters and self._changed.get(job_id) is changed:
+                del self._changed[job_id]
+        return await self.get(job_id, user_id)
+
+    def _event_for(self, job_id: str) -> "_JobEvent":
+        event = self._changed.get(job_id)
+        if event is None:
+            event = self._changed[job_id] = _JobEvent()
+        return event
+
+    def _release(self, job_id: str):
+        admission = self._admissions.pop(job_id, None)
+        if admission is not None:
+            admission.release()
+
+    def _notify(self, job_id: str):
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            request_id_var.set(f"job-{job_id}")
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("error in analysis job worker", extra={"job_id": job_id})
+            finally:
+                self._release(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(_update_job, job_id, status=RUNNING)
+        if job is None:
+            return
+        self._notify(job_id)
+        logger.info("running analysis job", extra={"job_id": job_id, "sport": job.sport})
+
+        if not os.path.exists(job.video_path):
+            await self._finish(job, error="Uploaded video is no longer available")
+            return
+
+        try:
+            result, cached = await self.runner(job)
+        except HTTPException as e:
+            await self._finish(job, error=e.detail)
+        except Exception as e:
+            logger.exception("error during analysis job", extra={"job_id": job_id})
+            await self._finish(job, error=f"Analysis error: {str(e)}")
+        else:
+            await self._finish(job, result=result, cached=cached)
+
+    async def _finish(self, job: AnalysisJob, result: Optional[str] = None, cached: bool = False, error: Optional[str] = None):
+        status = FAILED if error is not None else SUCCEEDED
+        await asyncio.to_thread(_update_job, job.id, status=status, result=result, cached=cached, error=error)
+        # Released before waiters hear about it, so the user can start another right away
+        self._release(job.id)
+        self._notify(job.id)
+        self.storage.remove(job.video_path)
+
+
+class _JobEvent(asyncio.Event):
+    """A job's change event and the number of long-polls waiting on it."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiters = 0
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _create_job(job_id: str, user_id: int, sport: str, video_path: str, content_hash: Optional[str] = None) -> AnalysisJob:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        job = AnalysisJob(
+            id=job_id,
+            user_id=user_id,
+            sport=sport,
+            status=QUEUED,
+            video_path=video_path,
+            content_hash=content_hash,
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+def _load_job(job_id: str) -> Optional[AnalysisJob]:
+    db = SessionLocal()
+    try:
+        job = db.get(AnalysisJob, job_id)
+        if job is not None:
+            db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+def _update_job(job_id: str, **fields) -> Optional[AnalysisJob]:
+    db = SessionLocal()
+    try:
+        job = db.get(AnalysisJob, job_id)
+        if job is None:
+            return None
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = datetime.utcnow()
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+def _requeue_unfinished():
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(AnalysisJob)
+            .filter(AnalysisJob.status.in_([QUEUED, RUNNING]))
+            .order_by(AnalysisJob.created_at)
+            .all()
+        )
+        for job in jobs:
+            job.status = QUEUED
+        db.commit()
+        return [(job.id, job.user_id, job.video_path) for job in jobs]
+    finally:
+        db.close()
@@ -1,26 +1,84 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
+import time
+
+# Cold-start reference point for the startup metrics, taken before the imports
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, EmailStr
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from sqlalchemy.orm import Session
-from datetime import timedelta
-import os
+from datetime import datetime, timedelta
+import json
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-from google import genai
-import time
 
-from database import get_db, User, init_db
+from database import get_db, User
+from migrations import run_migrations, DB_AUTO_MIGRATE
+from reference_files import ReferenceFileRegistry
+from context_cache import SportContextCache
+from analysis import run_analysis, run_batch_analysis, BatchClip, gemini_slots
+from admission import Admission, AdmissionController, AdmissionMiddleware, QUEUE_POSITION_HEADER, on_behalf_of
+from gemini_service import GeminiService, gemini_configured, GEMINI_MODEL
+from jobs import JobQueue, new_job_id
+from uploads import UploadSizeLimitMiddleware, receive_form, multipart_openapi, BATCH_MAX_CLIPS, VIDEO_SCHEMA
+from temp_storage import TempStorage
+from resumable_uploads import UploadSessions
+from result_cache import AnalysisResultCache, cache_key
+from video_processing import shutdown_pool, warm_pool
+from history import save_analysis, list_analyses, progress_summary
+from health import Readiness
+from observability import (
+    RequestContextMiddleware,
+    configure_logging,
+    get_logger,
+    metrics_payload,
+    record_startup_milestone,
+    set_startup_origin,
+)
 from auth import (
     get_password_hash,
     verify_password,
     create_access_token,
     get_current_user,
+    invalidate_user,
+    token_claims,
+    Principal,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
 load_dotenv()
+configure_logging()
+set_startup_origin(IMPORT_STARTED)
+logger = get_logger("api")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Only local setup happens before the server starts accepting requests;
+    # the slow work runs in the background and /readyz reports when it is done
+    temp_storage.start()
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    await asyncio.gather(warm_up_task, return_exceptions=True)
+    await job_queue.stop()
+    await temp_storage.stop()
+    shutdown_pool()
+
 
-app = FastAPI(title="ShadowSync API")
+app = FastAPI(title="ShadowSync API", lifespan=lifespan)
+
+# Rejects oversized video uploads before they are buffered
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# Per-user rate and concurrency limits for analyses; over-limit users are
+# turned away here before their upload is read
+admission = AdmissionController(gemini_slots)
+app.add_middleware(AdmissionMiddleware, admission=admission)
 
 # CORS middleware
 app.add_middleware(
@@ -29,20 +87,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Retry-After", QUEUE_POSITION_HEADER],
 )
 
-# Initialize database on startup
-@app.on_event("startup")
-def startup_event():
-    init_db()
+# Outermost: tags every request (and its logs) with an id and times it
+app.add_middleware(RequestContextMiddleware)
 
-# Gemini client
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key) if api_key else None
+# Gemini client; GEMINI_FAKE swaps in a simulated backend for load tests.
+# Every call goes through the service for timeouts, retries and the breaker.
+# The SDK is imported and the client built during warm-up, not here.
+gemini = GeminiService() if gemini_configured() else None
 
 BASE_DIR = Path(__file__).resolve().parent
-TEMP_UPLOADS_DIR = BASE_DIR / "temp_uploads"
-TEMP_UPLOADS_DIR.mkdir(exist_ok=True)
+
+# Unique per-request paths, disk quotas and a janitor for leftover files
+temp_storage = TempStorage()
+upload_sessions = UploadSessions(temp_storage)
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -58,11 +118,76 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
 class UserResponse(BaseModel):
     id: int
     email: str
     username: str
 
+class JobResponse(BaseModel):
+    job_id: str
+    sport: str
+    status: str
+    analysis: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class BatchClipResponse(BaseModel):
+    index: int
+    sport: str
+    filename: Optional[str] = None
+    analysis: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    seconds: float
+
+class BatchResponse(BaseModel):
+    results: List[BatchClipResponse]
+    batch_seconds: float
+    sum_clip_seconds: float
+    speedup: Optional[float] = None
+
+class AnalysisItem(BaseModel):
+    id: int
+    sport: str
+    created_at: datetime
+    similarity_score: Optional[int] = None
+    analysis: str
+
+class AnalysisPage(BaseModel):
+    items: List[AnalysisItem]
+    next_cursor: Optional[str] = None
+
+class UploadSessionCreate(BaseModel):
+    sport: str
+    size: int
+    filename: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    sport: str
+    size: int
+    chunk_size: int
+    received_bytes: int
+    missing_offsets: List[int]
+    complete: bool
+
+class SportProgress(BaseModel):
+    sport: str
+    analysis_count: int
+    average_score: Optional[float] = None
+    best_score: Optional[int] = None
+    last_score: Optional[int] = None
+    last_analysis_at: Optional[datetime] = None
+
+class ProgressSummary(BaseModel):
+    sports: List[SportProgress]
+
 # Sport configuration
 SPORT_PROMPTS = {
     "basketball": (
@@ -121,6 +246,96 @@ SPORT_VIDEOS = {
     "golf": BASE_DIR / "tigerSwing.mp4"
 }
 
+reference_registry = ReferenceFileRegistry(gemini, SPORT_VIDEOS) if gemini else None
+# Optional Gemini cached contexts for each sport's reference clip and prompt
+context_cache = SportContextCache(gemini) if gemini else None
+
+
+result_cache = AnalysisResultCache()
+
+
+def analysis_cache_key(sport: str, content_hash: str) -> str:
+    return cache_key(content_hash, sport, SPORT_PROMPTS[sport], GEMINI_MODEL)
+
+
+async def admit_analysis(user_id: int, sport: str, content_hash: Optional[str]) -> Admission:
+    """Admits an analysis of an uploaded clip.
+
+    Clips whose result is cached or already being computed never reach
+    Gemini, so they are not charged against the user's limits.
+    """
+    if content_hash and await result_cache.contains(analysis_cache_key(sport, content_hash)):
+        return admission.exempt(user_id)
+    return admission.admit(user_id)
+
+
+async def cached_analysis(user_id: int, sport: str, content_hash: Optional[str], user_path: Path, on_stage=None, on_text=None):
+    # Re-submitted clips are answered from the cache instead of calling Gemini again
+    prompt = SPORT_PROMPTS[sport]
+
+    def compute():
+        return run_analysis(
+            gemini, reference_registry, sport, prompt, user_path,
+            on_stage=on_stage, on_text=on_text, context_cache=context_cache, temp_storage=temp_storage,
+        )
+
+    # The user's Gemini calls take their turn in the fair scheduler
+    with on_behalf_of(user_id):
+        if content_hash:
+            analysis, cached = await result_cache.get_or_compute(analysis_cache_key(sport, content_hash), sport, compute)
+        else:
+            analysis, cached = await compute(), False
+
+    try:
+        await asyncio.to_thread(save_analysis, user_id, sport, analysis, content_hash)
+    except Exception as e:
+        logger.warning("could not save analysis history", extra={"error": str(e)})
+    return analysis, cached
+
+
+async def run_job(job):
+    return await cached_analysis(job.user_id, job.sport, job.content_hash, Path(job.video_path))
+
+
+job_queue = JobQueue(run_job, temp_storage)
+
+readiness = Readiness()
+
+
+async def warm_up():
+    """Startup work that would otherwise delay serving or the first analysis."""
+    async def database():
+        if DB_AUTO_MIGRATE:
+            await asyncio.to_thread(run_migrations)
+        if gemini:
+            # Picks up jobs left queued or running by a previous process
+            await job_queue.start()
+            reference_registry.start_prewarm()
+
+    steps = {"database": database(), "video_pool": warm_pool()}
+    if gemini:
+        steps["gemini"] = gemini.warm_up()
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for step, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.error("warm-up step failed", extra={"step": step, "error": str(result)})
+            readiness.fail(step, result)
+    readiness.warmed_up = True
+    record_startup_milestone("warm_up")
+
+
+def job_response(job) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        sport=job.sport,
+        status=job.status,
+        analysis=job.result,
+        cached=bool(job.cached),
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
 # Auth endpoints
 @app.post("/api/signup", response_model=Token)
 def signup(user: UserCreate, db: Session = Depends(get_db)):
@@ -143,7 +358,7 @@ def signup(user: UserCreate, db: Session = Depends(get_db)):
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": db_user.email}, expires_delta=access_token_expires
+        data=token_claims(db_user), expires_delta=access_token_expires
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
@@ -161,127 +376,429 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": db_user.email}, expires_delta=access_token_expires
+        data=token_claims(db_user), expires_delta=access_token_expires
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @app.get("/api/me", response_model=UserResponse)
-def get_me(current_user: User = Depends(get_current_user)):
+def get_me(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 
+def check_analysis_available(sport: str):
+    if not gemini:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
+
+    if sport not in SPORT_PROMPTS:
+        raise HTTPException(status_code=400, detail="Unsupported sport")
+
+    reference_path = SPORT_VIDEOS[sport]
+
+    if not reference_path.exists():
+        raise HTTPException(
+            status_code=500,
+            detail=f"Reference video for {sport} not found"
+        )
+
+
+@app.post("/api/change-password", response_model=Token)
+def change_password(
+    change: PasswordChange,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_user = db.query(User).filter(User.id == current_user.id).first()
+    if not db_user or not verify_password(change.current_password, db_user.hashed_password):
+        raise HTTPException(status_code=400, detail="Incorrect password")
+
+    # Bumping the token version revokes every previously issued token
+    db_user.hashed_password = get_password_hash(change.new_password)
+    db_user.token_version = (db_user.token_version or 0) + 1
+    db.commit()
+    db.refresh(db_user)
+    invalidate_user(db_user.id)
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data=token_claims(db_user), expires_delta=access_token_expires
+    )
+
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+# The video endpoints parse their own multipart bodies (see uploads.receive_form)
+VIDEO_UPLOAD_BODY = multipart_openapi({"user_video": VIDEO_SCHEMA})
+
+
 # Video analysis endpoint
-@app.post("/api/analyze-video/{sport}")
+@app.post("/api/analyze-video/{sport}", openapi_extra=VIDEO_UPLOAD_BODY)
 async def analyze_video(
     sport: str,
-    user_video: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
 ):
     try:
-        if not client:
-            raise HTTPException(status_code=500, detail="Gemini API key not configured")
+        check_analysis_available(sport)
 
-        if sport not in SPORT_PROMPTS:
-            raise HTTPException(status_code=400, detail="Unsupported sport")
+        logger.info("starting analysis", extra={"sport": sport, "user_id": current_user.id})
 
-        reference_path = SPORT_VIDEOS[sport]
+        # The received video and the admission are released however the analysis ends
+        with await receive_video(request, current_user.id) as form:
+            upload = form.file("user_video")
+            with await admit_analysis(current_user.id, sport, upload.saved.sha256):
+                analysis, cached = await cached_analysis(current_user.id, sport, upload.saved.sha256, upload.temp.path)
 
-        if not reference_path.exists():
-            raise HTTPException(
-                status_code=500,
-                detail=f"Reference video for {sport} not found"
-            )
+        return {"sport": sport, "analysis": analysis, "cached": cached}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("error during analysis", extra={"sport": sport})
+        raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
 
-        print(f"Starting analysis for sport: {sport}")
 
-        # Upload reference video
-        print(f"Uploading reference video: {reference_path}")
-        referenceFile = client.files.upload(path=str(reference_path))
-        prompt = SPORT_PROMPTS[sport]
+def receive_video(request: Request, user_id: int, prefix: str = "upload"):
+    return receive_form(
+        request, lambda filename: temp_storage.open(user_id, filename, prefix=prefix), required=("user_video",)
+    )
 
-        # Save uploaded user video temporarily
-        user_path = TEMP_UPLOADS_DIR / f"temp_{current_user.id}_{user_video.filename}"
-        print(f"Saving user video to: {user_path}")
-        with open(user_path, "wb") as f:
-            f.write(await user_video.read())
 
-        print(f"Uploading user video to Gemini")
-        myfile = client.files.upload(path=str(user_path))
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        # Wait for both files to be processed
-        print("Waiting for files to be processed...")
-        max_wait = 60  # Maximum 60 seconds wait time
-        waited = 0
-        while waited < max_wait:
-            file_state_user = client.files.get(name=myfile.name)
-            file_state_reference = client.files.get(name=referenceFile.name)
 
-            if file_state_user.state == "ACTIVE" and file_state_reference.state == "ACTIVE":
-                print("Both files are active")
-                break
-            elif file_state_user.state == "FAILED" or file_state_reference.state == "FAILED":
-                # Get detailed error information
-                user_error = getattr(file_state_user, 'error', 'Unknown error') if file_state_user.state == "FAILED" else None
-                ref_error = getattr(file_state_reference, 'error', 'Unknown error') if file_state_reference.state == "FAILED" else None
-
-                error_details = []
-                if user_error:
-                    error_details.append(f"Your video failed: {user_error}")
-                if ref_error:
-                    error_details.append(f"Reference video failed: {ref_error}")
-
-                error_msg = " | ".join(error_details) if error_details else "File processing failed"
-
-                # Add helpful message for user video failures
-                if file_state_user.state == "FAILED":
-                    error_msg += ". Try converting your video to MP4 format or reducing its size/length."
-
-                print(f"File processing failed - User state: {file_state_user.state}, Reference state: {file_state_reference.state}")
-                print(f"Error details: {error_msg}")
-                raise HTTPException(status_code=500, detail=error_msg)
-            time.sleep(1)
-            waited += 1
-
-        if waited >= max_wait:
-            raise HTTPException(status_code=500, detail="File processing timeout")
-
-        # Generate analysis
-        print("Generating analysis with Gemini...")
-
-        # Create the content parts with file URIs
-        from google.genai.types import Part
-
-        contents = [
-            prompt,
-            Part.from_uri(file_uri=myfile.uri, mime_type=myfile.mime_type),
-            Part.from_uri(file_uri=referenceFile.uri, mime_type=referenceFile.mime_type),
-        ]
+SSE_KEEPALIVE_SECONDS = 15
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=contents,
-        )
+# Holds streaming producers whose client went away until they finish
+background_tasks = set()
+
+
+@app.post("/api/analyze-video/{sport}/stream", openapi_extra=VIDEO_UPLOAD_BODY)
+async def analyze_video_stream(
+    sport: str,
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
+):
+    # Same pipeline as analyze_video, but reports stage changes and streams the
+    # generated text as Server-Sent Events while Gemini produces it
+    check_analysis_available(sport)
+
+    upload = (await receive_video(request, current_user.id)).file("user_video")
+    try:
+        admitted = await admit_analysis(current_user.id, sport, upload.saved.sha256)
+    except BaseException:
+        upload.temp.close()
+        raise
+    return analysis_event_stream(current_user.id, sport, upload.saved, upload.temp, admitted)
+
+
+def analysis_event_stream(user_id: int, sport: str, saved, upload, admitted) -> StreamingResponse:
+    """Runs the analysis of a saved upload and streams its progress as SSE.
+
+    The producer owns ``upload`` and ``admitted`` and releases both when the
+    analysis ends.
+    """
+    events: asyncio.Queue = asyncio.Queue()
 
-        print("Analysis complete!")
+    def emit(event: str, data: dict):
+        events.put_nowait(sse_event(event, data))
 
-        # Clean up the temporary file
+    async def produce():
         try:
-            os.remove(user_path)
-            print(f"Cleaned up temp file: {user_path}")
+            analysis, cached = await cached_analysis(
+                user_id, sport, saved.sha256, upload.path,
+                on_stage=lambda stage: emit("stage", {"stage": stage}),
+                on_text=lambda text: emit("chunk", {"text": text}),
+            )
+            emit("done", {"sport": sport, "analysis": analysis, "cached": cached})
+        except HTTPException as e:
+            emit("error", {"detail": e.detail})
         except Exception as e:
-            print(f"Warning: Could not remove temp file {user_path}: {e}")
+            logger.exception("error during analysis", extra={"sport": sport})
+            emit("error", {"detail": f"Analysis error: {str(e)}"})
+        finally:
+            upload.close()
+            admitted.release()
+            events.put_nowait(None)
+
+    # Started here rather than in the generator: if the client disconnects
+    # before the body is sent the generator never runs, and the producer is
+    # what releases the upload and the admission. It keeps running either
+    # way, so the result still lands in the cache.
+    producer = asyncio.create_task(produce())
+    background_tasks.add(producer)
+    producer.add_done_callback(background_tasks.discard)
+
+    async def stream():
+        yield sse_event("stage", {"stage": "received"})
+        while True:
+            try:
+                message = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message is None:
+                break
+            yield message
+        await producer
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def upload_session_response(session) -> UploadSessionResponse:
+    missing = session.missing_offsets
+    return UploadSessionResponse(
+        upload_id=session.id,
+        sport=session.sport,
+        size=session.size,
+        chunk_size=session.chunk_size,
+        received_bytes=session.received_bytes,
+        missing_offsets=missing,
+        complete=not missing,
+    )
+
 
-        return {"sport": sport, "analysis": response.text}
+@app.post("/api/uploads", response_model=UploadSessionResponse, status_code=201)
+async def create_upload_session(
+    upload: UploadSessionCreate,
+    current_user: Principal = Depends(get_current_user)
+):
+    # Resumable alternative to the multipart endpoints for large recordings
+    check_analysis_available(upload.sport)
+    session = await upload_sessions.create(current_user.id, upload.sport, upload.filename, upload.size)
+    return upload_session_response(session)
+
+
+@app.get("/api/uploads/{upload_id}", response_model=UploadSessionResponse)
+def get_upload_session(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    return upload_session_response(upload_sessions.get(upload_id, current_user.id))
+
+
+@app.put("/api/uploads/{upload_id}/chunks", response_model=UploadSessionResponse)
+async def put_upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_current_user)
+):
+    session = upload_sessions.get(upload_id, current_user.id)
+    await upload_sessions.write_chunk(session, offset, request.stream(), x_chunk_sha256)
+    return upload_session_response(session)
+
+
+@app.delete("/api/uploads/{upload_id}", status_code=204)
+def delete_upload_session(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    upload_sessions.discard(upload_sessions.get(upload_id, current_user.id))
+    return Response(status_code=204)
 
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    session = upload_sessions.get(upload_id, current_user.id)
+    check_analysis_available(session.sport)
+    # Checked first so a refused finalize leaves the session in place to be
+    # retried; charged once the clip's hash shows whether it is cached
+    admission.check(current_user.id)
+    upload, saved = await upload_sessions.finalize(session)
+    try:
+        with upload, await admit_analysis(current_user.id, session.sport, saved.sha256):
+            analysis, cached = await cached_analysis(current_user.id, session.sport, saved.sha256, upload.path)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error during analysis: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("error during analysis", extra={"sport": session.sport})
         raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
+    return {"sport": session.sport, "analysis": analysis, "cached": cached}
+
+
+@app.post("/api/uploads/{upload_id}/finalize/stream")
+async def finalize_upload_stream(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    session = upload_sessions.get(upload_id, current_user.id)
+    check_analysis_available(session.sport)
+    admission.check(current_user.id)
+    upload, saved = await upload_sessions.finalize(session)
+    try:
+        admitted = await admit_analysis(current_user.id, session.sport, saved.sha256)
+    except BaseException:
+        upload.close()
+        raise
+    return analysis_event_stream(current_user.id, session.sport, saved, upload, admitted)
+
+
+@app.post("/api/analyze-video/{sport}/jobs", response_model=JobResponse, status_code=202,
+          openapi_extra=VIDEO_UPLOAD_BODY)
+async def submit_analysis_job(
+    sport: str,
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
+):
+    check_analysis_available(sport)
+
+    # The video and the admission outlive this request; the job queue
+    # releases both when the job finishes
+    form = await receive_video(request, current_user.id, prefix="job")
+    admitted = None
+    try:
+        upload = form.file("user_video")
+        admitted = await admit_analysis(current_user.id, sport, upload.saved.sha256)
+        job = await job_queue.submit(
+            new_job_id(), current_user.id, sport, str(upload.temp.path), upload.saved.sha256, admitted
+        )
+    except BaseException:
+        form.close()
+        if admitted is not None:
+            admitted.release()
+        raise
+    return job_response(job)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_analysis_job(job_id: str, current_user: Principal = Depends(get_current_user)):
+    job = await job_queue.get(job_id, current_user.id)
+    return job_response(job)
+
+
+@app.get("/api/jobs/{job_id}/wait", response_model=JobResponse)
+async def wait_for_analysis_job(
+    job_id: str,
+    timeout: float = 25,
+    current_user: Principal = Depends(get_current_user)
+):
+    # Long-poll: returns as soon as the job changes state, or after `timeout` seconds
+    job = await job_queue.wait(job_id, current_user.id, min(max(timeout, 0), 60))
+    return job_response(job)
+
+
+@app.post("/api/analyze-batch", response_model=BatchResponse, openapi_extra=multipart_openapi({
+    "videos": {"type": "array", "items": VIDEO_SCHEMA},
+    "sports": {"type": "array", "items": {"type": "string"}},
+}))
+async def analyze_batch(
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
+):
+    # One request for a whole session of clips: uploads, processing waits and
+    # generations overlap instead of running once per clip
+    # The batch's Gemini calls share the user's turns
+    with on_behalf_of(current_user.id), await receive_form(
+        request,
+        lambda filename: temp_storage.open(current_user.id, filename, prefix="batch"),
+        required=("videos",),
+        max_files=BATCH_MAX_CLIPS,
+    ) as form:
+        videos = form.files_for("videos")
+        sports = form.fields.get("sports", [])
+        if len(videos) != len(sports):
+            raise HTTPException(status_code=400, detail="Each video needs exactly one sport")
+        for sport in set(sports):
+            check_analysis_available(sport)
+
+        started = time.perf_counter()
+        results = [
+            BatchClipResponse(index=index, sport=sport, filename=video.filename, seconds=0.0)
+            for index, (video, sport) in enumerate(zip(videos, sports))
+        ]
+        paths = [video.temp.path for video in videos]
+        saved = [video.saved for video in videos]
+
+        keys = [analysis_cache_key(sport, s.sha256) for s, sport in zip(saved, sports)]
+        hits = await asyncio.gather(*(result_cache.lookup(key) for key in keys), return_exceptions=True)
+
+        # Identical clips in one batch share a single analysis
+        misses = {}
+        for index, hit in enumerate(hits):
+            if isinstance(hit, str):
+                results[index].analysis = hit
+                results[index].cached = True
+            else:
+                misses.setdefault(keys[index], []).append(index)
+
+        clips = [BatchClip(sports[i], SPORT_PROMPTS[sports[i]], paths[i]) for i, *_ in misses.values()]
+        # A batch counts as one analysis, charged only if a clip reaches Gemini
+        with admission.admit(current_user.id) if clips else admission.exempt(current_user.id):
+            outcomes = await run_batch_analysis(gemini, reference_registry, clips, context_cache, temp_storage)
+        for (key, (first, *duplicates)), outcome in zip(misses.items(), outcomes):
+            results[first].seconds = outcome.seconds
+            for index in (first, *duplicates):
+                results[index].analysis = outcome.analysis
+                results[index].error = outcome.error
+                results[index].cached = index != first and outcome.analysis is not None
+            if outcome.analysis is not None:
+                await result_cache.store(key, sports[first], outcome.analysis)
+
+        for result, upload in zip(results, saved):
+            if result.analysis is None:
+                continue
+            try:
+                await asyncio.to_thread(save_analysis, current_user.id, result.sport, result.analysis, upload.sha256)
+            except Exception as e:
+                logger.warning("could not save analysis history", extra={"error": str(e)})
+
+    # Each clip's own pipeline time is roughly what a single call would have
+    # taken, so the sum approximates running the clips one after another
+    batch_seconds = time.perf_counter() - started
+    sum_clip_seconds = sum(result.seconds for result in results)
+    speedup = sum_clip_seconds / batch_seconds if sum_clip_seconds and batch_seconds else None
+    logger.info("batch finished", extra={
+        "clips": len(results),
+        "batch_seconds": round(batch_seconds, 4),
+        "sum_clip_seconds": round(sum_clip_seconds, 4),
+    })
+    return BatchResponse(
+        results=results,
+        batch_seconds=batch_seconds,
+        sum_clip_seconds=sum_clip_seconds,
+        speedup=speedup,
+    )
+
+
+@app.get("/api/analyses", response_model=AnalysisPage)
+def get_analyses(
+    sport: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    rows, next_cursor = list_analyses(db, current_user.id, sport=sport, cursor=cursor, limit=limit)
+    return AnalysisPage(
+        items=[
+            AnalysisItem(
+                id=row.id,
+                sport=row.sport,
+                created_at=row.created_at,
+                similarity_score=row.similarity_score,
+                analysis=row.analysis,
+            )
+            for row in rows
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+@app.get("/api/analyses/summary", response_model=ProgressSummary)
+def get_progress_summary(
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return ProgressSummary(sports=[
+        SportProgress(
+            sport=stats.sport,
+            analysis_count=stats.analysis_count,
+            average_score=stats.score_total / stats.scored_count if stats.scored_count else None,
+            best_score=stats.best_score,
+            last_score=stats.last_score,
+            last_analysis_at=stats.last_analysis_at,
+        )
+        for stats in progress_summary(db, current_user.id)
+    ])
 
 
 @app.get("/api/sports")
@@ -289,6 +806,29 @@ def get_sports():
     return {"sports": list(SPORT_PROMPTS.keys())}
 
 
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    ready, checks = await readiness.check(gemini)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.get("/")
 def root():
     return {"message": "ShadowSync API"}
+
+
+record_startup_milestone("import")
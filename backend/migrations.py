@@ -0,0 +1,232 @@
+"""Versioned schema migrations.
+
+Every migration runs once, in order, and is recorded in the
+``schema_migrations`` table. Table definitions here are frozen copies of the
+schema at that version, so later changes to the models in database.py must
+come with a new migration at the end of MIGRATIONS instead of an edit to an
+existing one.
+
+Run ``python migrations.py`` to apply pending migrations by hand (e.g. before
+starting several workers); the API also applies them on startup unless
+DB_AUTO_MIGRATE is disabled.
+"""
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    inspect, text,
+)
+
+from database import engine
+from observability import configure_logging, get_logger
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+# Key of the PostgreSQL advisory lock held while migrating
+MIGRATION_LOCK_KEY = 7_460_135_201
+
+logger = get_logger(__name__)
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _column_names(conn, table_name):
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def _add_column_if_missing(conn, table_name, column_ddl):
+    column_name = column_ddl.split()[0]
+    if column_name not in _column_names(conn, table_name):
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+
+
+def _0001_users(conn):
+    metadata = MetaData()
+    users = Table(
+        "users", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("email", String, unique=True, index=True),
+        Column("username", String, unique=True, index=True),
+        Column("hashed_password", String),
+    )
+    users.create(conn, checkfirst=True)
+
+
+def _0002_users_token_version(conn):
+    _add_column_if_missing(conn, "users", "token_version INTEGER NOT NULL DEFAULT 0")
+
+
+def _0003_analysis_tables(conn):
+    metadata = MetaData()
+    Table("users", metadata, Column("id", Integer, primary_key=True))
+    tables = [
+        Table(
+            "reference_files", metadata,
+            Column("sport", String, primary_key=True),
+            Column("file_name", String),
+            Column("file_uri", String),
+            Column("mime_type", String),
+            Column("source_hash", String),
+            Column("uploaded_at", DateTime),
+            Column("expires_at", DateTime),
+        ),
+        Table(
+            "analysis_jobs", metadata,
+            Column("id", String, primary_key=True),
+            Column("user_id", Integer, ForeignKey("users.id"), index=True),
+            Column("sport", String),
+            Column("status", String, index=True),
+            Column("video_path", String),
+            Column("content_hash", String, nullable=True),
+            Column("result", Text, nullable=True),
+            Column("cached", Boolean, default=False),
+            Column("error", Text, nullable=True),
+            Column("created_at", DateTime),
+            Column("updated_at", DateTime),
+        ),
+        Table(
+            "analysis_cache", metadata,
+            Column("key", String, primary_key=True),
+            Column("sport", String),
+            Column("analysis", Text),
+            Column("created_at", DateTime, index=True),
+            Column("last_used_at", DateTime, index=True),
+            Column("hits", Integer, default=0),
+        ),
+        Table(
+            "analyses", metadata,
+            Column("id", Integer, primary_key=True),
+            Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+            Column("sport", String, nullable=False),
+            Column("created_at", DateTime, nullable=False),
+            Column("similarity_score", Integer, nullable=True),
+            Column("analysis", Text),
+            Column("content_hash", String, nullable=True),
+            Index("ix_analyses_user_created", "user_id", "created_at", "id"),
+            Index("ix_analyses_user_sport", "user_id", "sport", "created_at", "id"),
+        ),
+        Table(
+            "user_sport_stats", metadata,
+            Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+            Column("sport", String, primary_key=True),
+            Column("analysis_count", Integer, nullable=False, default=0),
+            Column("scored_count", Integer, nullable=False, default=0),
+            Column("score_total", Integer, nullable=False, default=0),
+            Column("best_score", Integer, nullable=True),
+            Column("last_score", Integer, nullable=True),
+            Column("last_analysis_at", DateTime, nullable=True),
+        ),
+    ]
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+    # Databases created with create_all before these columns existed
+    _add_column_if_missing(conn, "analysis_jobs", "content_hash VARCHAR")
+    _add_column_if_missing(conn, "analysis_jobs", "cached BOOLEAN")
+
+
+def _0004_analyses_unique_hash(conn):
+    # Concurrent saves of the same clip could both pass the old
+    # check-then-insert; keep the first copy and let the index refuse the rest
+    conn.execute(text("""
+        DELETE FROM analyses
+        WHERE content_hash IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM analyses
+            WHERE content_hash IS NOT NULL
+            GROUP BY user_id, sport, content_hash
+        )
+    """))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_analyses_user_sport_hash "
+        "ON analyses (user_id, sport, content_hash)"
+    ))
+
+    # The read-modify-write aggregates lost updates under the same race, so
+    # rebuild them from the rows that are left
+    conn.execute(text("DELETE FROM user_sport_stats"))
+    conn.execute(text("""
+        INSERT INTO user_sport_stats (
+            user_id, sport, analysis_count, scored_count, score_total,
+            best_score, last_score, last_analysis_at
+        )
+        SELECT a.user_id, a.sport, COUNT(*), COUNT(a.similarity_score),
+               COALESCE(SUM(a.similarity_score), 0), MAX(a.similarity_score),
+               (SELECT s.similarity_score FROM analyses s
+                WHERE s.user_id = a.user_id AND s.sport = a.sport
+                  AND s.similarity_score IS NOT NULL
+                ORDER BY s.created_at DESC, s.id DESC LIMIT 1),
+               MAX(a.created_at)
+        FROM analyses a
+        GROUP BY a.user_id, a.sport
+    """))
+
+
+MIGRATIONS = [
+    (1, "users", _0001_users),
+    (2, "users_token_version", _0002_users_token_version),
+    (3, "analysis_tables", _0003_analysis_tables),
+    (4, "analyses_unique_hash", _0004_analyses_unique_hash),
+]
+
+
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(schema_migrations.select())}
+
+
+@contextmanager
+def locked_transaction(db_engine):
+    """A transaction that holds the migration lock until it ends.
+
+    Workers started together with DB_AUTO_MIGRATE all run the migrations;
+    the lock makes them take turns, so each sees what the others applied.
+    """
+    if db_engine.dialect.name == "sqlite":
+        # pysqlite begins lazily and would only take the write lock at the
+        # first write, after the version check; BEGIN IMMEDIATE takes it now
+        with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+            conn.exec_driver_sql("COMMIT")
+        return
+    with db_engine.begin() as conn:
+        if db_engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        yield conn
+
+
+def run_migrations(db_engine=engine):
+    applied = []
+    with locked_transaction(db_engine) as conn:
+        done = applied_versions(conn)
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        # One transaction per migration so a failure leaves earlier ones applied
+        with locked_transaction(db_engine) as conn:
+            if version in applied_versions(conn):
+                continue
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+        logger.info("applied migration", extra={"version": version, "migration": name})
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    configure_logging()
+    applied = run_migrations()
+    if not applied:
+        print("Database schema is up to date")
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from observability import get_logger
+from video_processing import get_pool
+
+MOTION_PREFILTER = os.getenv("MOTION_PREFILTER", "true").lower() in ("1", "true", "yes")
+MOTION_SAMPLE_FPS = float(os.getenv("MOTION_SAMPLE_FPS", "5"))
+MOTION_FRAME_WIDTH = 96
+MOTION_FRAME_HEIGHT = 64
+# A pixel counts as moving when its gray level changes by more than this
+MOTION_PIXEL_DELTA = 25
+# Fraction of moving pixels below which a clip is considered static. A
+# full-body motion filmed from a distance moves only about 1% of the pixels.
+MOTION_MIN_ENERGY = float(os.getenv("MOTION_MIN_ENERGY", "0.002"))
+# Brief changes above this are scene cuts or exposure jumps, not motion
+MOTION_CUT_ENERGY = 0.5
+# A cut lasts at most this many sampled frame pairs; longer stretches above
+# MOTION_CUT_ENERGY are fast motion
+MOTION_CUT_MAX_FRAMES = 2
+# When more than this fraction of frame pairs is above MOTION_CUT_ENERGY the
+# camera itself is moving (panning, handheld), so the whole clip is kept
+MOTION_PANNING_FRACTION = 0.5
+# Frames at or above this fraction of the peak belong to the active window
+MOTION_ACTIVE_FRACTION = 0.25
+MOTION_GAP_SECONDS = 1.0
+MOTION_PADDING_SECONDS = float(os.getenv("MOTION_PADDING_SECONDS", "1.0"))
+MOTION_MIN_WINDOW_SECONDS = 2.0
+# Trimming re-encodes the clip, so it only happens when it removes enough
+MOTION_MIN_TRIM_FRACTION = 0.2
+MOTION_TIMEOUT = 60
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class MotionReport:
+    duration: float
+    peak_energy: float
+    window: Optional[Tuple[float, float]]
+    seconds: float
+
+    @property
+    def static(self) -> bool:
+        return self.peak_energy < MOTION_MIN_ENERGY
+
+    @property
+    def trimmed_seconds(self) -> float:
+        if self.window is None:
+            return 0.0
+        return self.duration - (self.window[1] - self.window[0])
+
+
+def _decode_gray_frames(src: str, fps: float, width: int, height: int) -> np.ndarray:
+    ffmpeg = shutil.which("ffmpeg")
+    result = subprocess.run(
+        [
+            ffmpeg, "-v", "error", "-i", src, "-an",
+            "-vf", f"fps={fps},scale={width}:{height},format=gray",
+            "-f", "rawvideo", "-",
+        ],
+        check=True,
+        capture_output=True,
+        timeout=MOTION_TIMEOUT,
+    )
+    frame_size = width * height
+    count = len(result.stdout) // frame_size
+    return np.frombuffer(result.stdout[:count * frame_size], dtype=np.uint8).reshape(count, height, width)
+
+
+def motion_energy(frames: np.ndarray) -> np.ndarray:
+    """Fraction of pixels that changed noticeably between consecutive frames."""
+    if len(frames) < 2:
+        return np.zeros(0)
+    diffs = np.abs(np.diff(frames.astype(np.int16), axis=0))
+    return (diffs > MOTION_PIXEL_DELTA).mean(axis=(1, 2))
+
+
+def suppress_cuts(energy: np.ndarray) -> np.ndarray:
+    """Flattens short spikes above MOTION_CUT_ENERGY to the level around them.
+
+    Runs of at most MOTION_CUT_MAX_FRAMES are cuts and take the higher of
+    their two neighbours, so a cut in the middle of a motion does not split
+    it; longer runs are real motion and are left alone.
+    """
+    energy = energy.copy()
+    over = energy > MOTION_CUT_ENERGY
+    start = 0
+    while start < len(energy):
+        if not over[start]:
+            start += 1
+            continue
+        end = start
+        while end < len(energy) and over[end]:
+            end += 1
+        if end - start <= MOTION_CUT_MAX_FRAMES:
+            neighbours = np.concatenate((energy[max(start - 1, 0):start], energy[end:end + 1]))
+            energy[start:end] = neighbours.max() if len(neighbours) else 0.0
+        start = end
+    return energy
+
+
+def active_window(energy: np.ndarray, fps: float) -> Optional[Tuple[float, float]]:
+    """(start, end) in seconds of the most active stretch, padded, or None if
+    trimming would not remove enough of the clip to be worth re-encoding."""
+    duration = (len(energy) + 1) / fps
+    if len(energy) == 0:
+        return None
+
+    # Smooth over about a second so single noisy frames do not split a motion
+    width = max(1, int(round(fps)))
+    smoothed = np.convolve(energy, np.ones(width) / width, mode="same")
+    threshold = max(MOTION_MIN_ENERGY, smoothed.max() * MOTION_ACTIVE_FRACTION)
+    active = np.flatnonzero(smoothed >= threshold)
+    if len(active) == 0:
+        return None
+
+    # Group active frames into runs, bridging short pauses, and keep the run
+    # carrying the most motion
+    max_gap = int(MOTION_GAP_SECONDS * fps)
+    runs = []
+    run_start = previous = active[0]
+    for index in active[1:]:
+        if index - previous > max_gap:
+            runs.append((run_start, previous))
+            run_start = index
+        previous = index
+    runs.append((run_start, previous))
+    first, last = max(runs, key=lambda run: energy[run[0]:run[1] + 1].sum())
+
+    start = first / fps - MOTION_PADDING_SECONDS
+    end = (last + 2) / fps + MOTION_PADDING_SECONDS
+    shortfall = MOTION_MIN_WINDOW_SECONDS - (end - start)
+    if shortfall > 0:
+        start -= shortfall / 2
+        end += shortfall / 2
+    start, end = max(0.0, float(start)), min(duration, float(end))
+
+    if end - start > duration * (1 - MOTION_MIN_TRIM_FRACTION):
+        return None
+    return start, end
+
+
+def _motion_profile(src: str, fps: float, width: int, height: int) -> Tuple[float, float, Optional[Tuple[float, float]]]:
+    frames = _decode_gray_frames(src, fps, width, height)
+    if len(frames) < 2:
+        raise ValueError("too few frames decoded")
+    changes = motion_energy(frames)
+    duration = len(frames) / fps
+    if np.mean(changes > MOTION_CUT_ENERGY) > MOTION_PANNING_FRACTION:
+        # Large changes throughout are camera movement, not cuts: keep it all
+        return duration, float(changes.max()), None
+    energy = suppress_cuts(changes)
+    peak = float(energy.max()) if len(energy) else 0.0
+    if peak < MOTION_MIN_ENERGY:
+        return duration, peak, None
+    return duration, peak, active_window(energy, fps)
+
+
+async def analyze_motion(src: Path) -> Optional[MotionReport]:
+    """Decode a low-resolution, low-fps copy of the clip and measure how much moves.
+
+    Returns None when the prefilter is disabled, ffmpeg is missing or the clip
+    cannot be decoded, in which case the video is sent on unchanged.
+    """
+    if not MOTION_PREFILTER or not shutil.which("ffmpeg"):
+        return None
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        duration, peak, window = await loop.run_in_executor(
+            get_pool(), _motion_profile, str(src),
+            MOTION_SAMPLE_FPS, MOTION_FRAME_WIDTH, MOTION_FRAME_HEIGHT,
+        )
+    except Exception as e:
+        logger.warning("could not measure motion", extra={"file": src.name, "error": str(e)})
+        return None
+    return MotionReport(duration, peak, window, time.perf_counter() - started)
@@ -0,0 +1,232 @@
+"""Structured logging, timing spans, request ids and Prometheus metrics.
+
+Every log record carries the id of the request (or background job) it was
+emitted for, so one analysis can be followed from upload to generation.
+Metrics are served in Prometheus text format at ``/metrics``.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+_BYTES_BUCKETS = tuple(2 ** power for power in range(16, 29))  # 64 KB .. 256 MB
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "shadowsync_http_request_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "shadowsync_stage_seconds", "Duration of analysis pipeline stages",
+    ["stage", "outcome"], buckets=_LATENCY_BUCKETS,
+)
+UPLOAD_BYTES = Histogram(
+    "shadowsync_upload_bytes", "Size of user videos as received and as sent to Gemini",
+    ["kind"], buckets=_BYTES_BUCKETS,
+)
+POLL_ITERATIONS = Histogram(
+    "shadowsync_file_poll_iterations", "Gemini file state polling rounds per wait",
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30),
+)
+GEMINI_ERRORS = Counter(
+    "shadowsync_gemini_errors_total", "Failed Gemini calls",
+    ["operation", "error_type"],
+)
+GEMINI_RETRIES = Counter(
+    "shadowsync_gemini_retries_total", "Gemini calls retried after a transient error",
+    ["operation"],
+)
+GEMINI_CIRCUIT_OPEN = Gauge(
+    "shadowsync_gemini_circuit_open", "1 while the Gemini circuit breaker is failing calls fast",
+)
+REJECTIONS = Counter(
+    "shadowsync_rejections_total", "Videos rejected as not showing the sport",
+    ["sport", "reason"],
+)
+TEMP_BYTES = Gauge(
+    "shadowsync_temp_bytes", "Bytes of uploaded videos currently held in temp storage",
+)
+TEMP_SWEPT_BYTES = Counter(
+    "shadowsync_temp_swept_bytes_total", "Bytes of orphaned temp files reclaimed by the janitor",
+)
+TEMP_QUOTA_REJECTIONS = Counter(
+    "shadowsync_temp_quota_rejections_total", "Uploads refused because a temp storage quota was full",
+    ["scope"],
+)
+STARTUP_SECONDS = Gauge(
+    "shadowsync_startup_seconds", "Seconds from the start of the app import to each startup milestone",
+    ["milestone"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "shadowsync_admission_rejections_total", "Analysis requests refused by admission control",
+    ["reason"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "shadowsync_admission_in_flight", "Analyses admitted and not yet finished",
+)
+GEMINI_QUEUE_DEPTH = Gauge(
+    "shadowsync_gemini_queue_depth", "Gemini calls waiting for a slot in the fair scheduler",
+)
+GEMINI_SLOTS_IN_USE = Gauge(
+    "shadowsync_gemini_slots_in_use", "Gemini slots held by uploads and generations",
+)
+GEMINI_QUEUE_WAIT_SECONDS = Histogram(
+    "shadowsync_gemini_queue_wait_seconds", "Time Gemini calls waited for a slot",
+    buckets=_LATENCY_BUCKETS,
+)
+AUTH_SECONDS = Histogram(
+    "shadowsync_auth_seconds", "Time to resolve the authenticated user",
+    ["source"], buckets=_LATENCY_BUCKETS,
+)
+
+logger = logging.getLogger("shadowsync")
+
+# Reference point for STARTUP_SECONDS; main.py moves it to before its imports
+_startup_origin = time.perf_counter()
+_startup_milestones = set()
+
+# Probe and metrics scrapes do not count as the first served request
+_FIRST_REQUEST_IGNORED_PATHS = ("/healthz", "/readyz", "/metrics")
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # Attributes every LogRecord has; anything else was passed via ``extra``
+    _reserved = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self._reserved})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.addFilter(_RequestIdFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logger.getChild(name)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def span(stage: str, log: Optional[logging.Logger] = None, timings: Optional[dict] = None, **fields):
+    """Time a pipeline stage, record it in STAGE_SECONDS and log the duration.
+
+    Yields a dict that the block can add fields to for the finishing log
+    line. The duration is also stored under ``stage`` in ``timings``.
+    """
+    log = log or logger
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield fields
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - started
+        if timings is not None:
+            timings[stage] = seconds
+        STAGE_SECONDS.labels(stage, outcome).observe(seconds)
+        level = logging.INFO if outcome == "ok" else logging.WARNING
+        message = "stage finished" if outcome == "ok" else "stage failed"
+        log.log(level, message, extra={"stage": stage, "seconds": round(seconds, 4), **fields})
+
+
+def record_gemini_error(operation: str, error: BaseException):
+    GEMINI_ERRORS.labels(operation, type(error).__name__).inc()
+
+
+def set_startup_origin(started: float):
+    global _startup_origin
+    _startup_origin = started
+
+
+def record_startup_milestone(milestone: str):
+    """Records the time since the startup origin, once per milestone."""
+    if milestone in _startup_milestones:
+        return
+    _startup_milestones.add(milestone)
+    seconds = time.perf_counter() - _startup_origin
+    STARTUP_SECONDS.labels(milestone).set(seconds)
+    logger.info("startup milestone", extra={"milestone": milestone, "seconds": round(seconds, 4)})
+
+
+def metrics_payload():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class RequestContextMiddleware:
+    """Assigns each request an id and records its latency.
+
+    An incoming X-Request-ID is reused so ids can be correlated with an
+    upstream proxy; the id is echoed back on the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        incoming = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")
+        request_id = incoming[:64] if incoming else new_request_id()
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # Route templates keep the label set bounded (no ids or sports)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, str(status_code)).observe(time.perf_counter() - started)
+            if status_code < 400 and route is not None and path not in _FIRST_REQUEST_IGNORED_PATHS:
+                record_startup_milestone("first_request")
+            request_id_var.reset(token)
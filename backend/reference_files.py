@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from database import SessionLocal, ReferenceFile
+from observability import get_logger, record_gemini_error
+
+# Gemini keeps uploaded files for 48 hours; refresh a while before that so a
+# request never races the remote expiry.
+DEFAULT_FILE_TTL = timedelta(hours=48)
+REFRESH_MARGIN = timedelta(minutes=int(os.getenv("REFERENCE_REFRESH_MARGIN_MINUTES", "60")))
+ACTIVE_WAIT_SECONDS = 120
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedReference:
+    name: str
+    uri: str
+    mime_type: str
+    source_hash: str
+    expires_at: datetime
+
+
+def _utcnow():
+    return datetime.utcnow()
+
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class ReferenceFileRegistry:
+    """Uploads each sport's reference clip once and reuses the Gemini file.
+
+    Entries are persisted in the ``reference_files`` table so a restart does
+    not re-upload clips that are still live on the Gemini side.
+    """
+
+    def __init__(self, gemini, videos: Dict[str, Path]):
+        self.gemini = gemini
+        self.videos = videos
+        self._entries: Dict[str, CachedReference] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._hashes: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._load_task: Optional[asyncio.Task] = None
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+    def start_prewarm(self):
+        if self._prewarm_task is None or self._prewarm_task.done():
+            self._prewarm_task = asyncio.create_task(self.prewarm())
+        return self._prewarm_task
+
+    async def prewarm(self):
+        await self._load_persisted()
+        sports = [sport for sport, path in self.videos.items() if path.exists()]
+        results = await asyncio.gather(
+            *(self.get(sport) for sport in sports), return_exceptions=True
+        )
+        for sport, result in zip(sports, results):
+            if isinstance(result, Exception):
+                logger.warning("could not prewarm reference video", extra={"sport": sport, "error": str(result)})
+            else:
+                logger.info("reference video ready", extra={"sport": sport, "file": result.name})
+
+    async def get(self, sport: str) -> CachedReference:
+        await self._load_persisted()
+        source_hash = await self._source_hash(sport)
+
+        entry = self._entries.get(sport)
+        if entry and self._is_fresh(entry, source_hash):
+            return entry
+
+        # Share a single upload between every request that needs this sport
+        task = self._inflight.get(sport)
+        if task is None:
+            task = asyncio.create_task(self._refresh(sport, source_hash))
+            self._inflight[sport] = task
+            task.add_done_callback(lambda done: self._forget_inflight(sport, done))
+        return await asyncio.shield(task)
+
+    def invalidate(self, sport: str, name: Optional[str] = None):
+        """Drops the sport's entry; with ``name``, only if it is still that file."""
+        entry = self._entries.get(sport)
+        if entry is not None and (name is None or entry.name == name):
+            del self._entries[sport]
+
+    def _forget_inflight(self, sport: str, task: asyncio.Task):
+        if self._inflight.get(sport) is task:
+            del self._inflight[sport]
+
+    def _is_fresh(self, entry: CachedReference, source_hash: str) -> bool:
+        if entry.source_hash != source_hash:
+            return False
+        return entry.expires_at - REFRESH_MARGIN > _utcnow()
+
+    async def _source_hash(self, sport: str) -> str:
+        path = self.videos[sport]
+        stat = await asyncio.to_thread(path.stat)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(sport)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = await asyncio.to_thread(_sha256_file, path)
+        self._hashes[sport] = (signature, digest)
+        return digest
+
+    async def _load_persisted(self):
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._restore_entries())
+        await asyncio.shield(self._load_task)
+
+    async def _restore_entries(self):
+        # Only trust persisted uploads that Gemini still reports as ACTIVE
+        try:
+            rows = await asyncio.to_thread(_load_rows)
+        except Exception as e:
+            logger.warning("could not load persisted reference videos", extra={"error": str(e)})
+            return
+        for row in rows:
+            entry = CachedReference(
+                name=row.file_name,
+                uri=row.file_uri,
+                mime_type=row.mime_type,
+                source_hash=row.source_hash,
+                expires_at=row.expires_at,
+            )
+            if not await self._is_remote_active(entry):
+                continue
+            self._entries.setdefault(row.sport, entry)
+
+    async def _is_remote_active(self, entry: CachedReference) -> bool:
+        try:
+            remote = await self.gemini.get_file(entry.name)
+        except Exception:
+            return False
+        return remote.state == "ACTIVE"
+
+    async def _refresh(self, sport: str, source_hash: str) -> CachedReference:
+        path = self.videos[sport]
+        logger.info("uploading reference video", extra={"sport": sport, "path": str(path)})
+        try:
+            entry = await self._upload_and_wait(path, source_hash)
+        except Exception as e:
+            record_gemini_error("reference_upload", e)
+            raise
+        try:
+            await asyncio.to_thread(_save_row, sport, entry)
+        except Exception as e:
+            # Still usable from memory; the next process just uploads it again
+            logger.warning("could not persist reference video", extra={"sport": sport, "error": str(e)})
+        self._entries[sport] = entry
+        return entry
+
+    async def _upload_and_wait(self, path: Path, source_hash: str) -> CachedReference:
+        uploaded = await self.gemini.upload_file(path)
+        deadline = time.monotonic() + ACTIVE_WAIT_SECONDS
+        remote = uploaded
+        while remote.state != "ACTIVE":
+            if remote.state == "FAILED":
+                error = getattr(remote, "error", "Unknown error")
+                raise RuntimeError(f"Reference video {path.name} failed processing: {error}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Reference video {path.name} processing timeout")
+            await asyncio.sleep(1)
+            remote = await self.gemini.get_file(uploaded.name)
+
+        expires_at = _to_naive_utc(remote.expiration_time) or _utcnow() + DEFAULT_FILE_TTL
+        return CachedReference(
+            name=remote.name,
+            uri=remote.uri,
+            mime_type=remote.mime_type,
+            source_hash=source_hash,
+            expires_at=expires_at,
+        )
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_rows():
+    db = SessionLocal()
+    try:
+        rows = db.query(ReferenceFile).all()
+        db.expunge_all()
+        return rows
+    finally:
+        db.close()
+
+
+def _save_row(sport: str, entry: CachedReference):
+    db = SessionLocal()
+    try:
+        db.merge(ReferenceFile(
+            sport=sport,
+            file_name=entry.name,
+            file_uri=entry.uri,
+            mime_type=entry.mime_type,
+            source_hash=entry.source_hash,
+            uploaded_at=_utcnow(),
+            expires_at=entry.expires_at,
+        ))
+        db.commit()
+    finally:
+        db.close()
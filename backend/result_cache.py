@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from database import SessionLocal, AnalysisCacheEntry
+from observability import get_logger
+
+ANALYSIS_CACHE_TTL = timedelta(hours=int(os.getenv("ANALYSIS_CACHE_TTL_HOURS", str(24 * 7))))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+
+logger = get_logger(__name__)
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(content_hash: str, sport: str, prompt: str, model: str) -> str:
+    # Editing a sport's prompt or switching models naturally misses old entries
+    raw = "|".join([content_hash, sport, prompt_version(prompt), model])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalysisResultCache:
+    """SQLite-backed LRU/TTL cache of analysis text keyed by ``cache_key``.
+
+    Identical requests that arrive while the first one is still running wait
+    on that computation instead of starting their own Gemini round-trip.
+    """
+
+    def __init__(self, ttl: timedelta = ANALYSIS_CACHE_TTL, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get_or_compute(self, key: str, sport: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Returns ``(analysis, cached)``; ``cached`` is False only for the caller that ran ``compute``."""
+        task = self._inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        hit = await asyncio.to_thread(_lookup, key, self.ttl)
+        if hit is not None:
+            return hit, True
+
+        # Re-check: another request may have started while we were reading
+        task = self._inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.create_task(self._compute_and_store(key, sport, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._forget_inflight(key, done))
+        return await asyncio.shield(task), False
+
+    async def lookup(self, key: str) -> Optional[str]:
+        task = self._inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task)
+        return await asyncio.to_thread(_lookup, key, self.ttl)
+
+    async def contains(self, key: str) -> bool:
+        """Whether ``key`` is cached or being computed; never waits and counts no hit."""
+        if key in self._inflight:
+            return True
+        return await asyncio.to_thread(_contains, key, self.ttl)
+
+    async def store(self, key: str, sport: str, analysis: str):
+        try:
+            await asyncio.to_thread(_store, key, sport, analysis, self.ttl, self.max_entries)
+        except Exception as e:
+            logger.warning("could not cache analysis result", extra={"error": str(e)})
+
+    def _forget_inflight(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _compute_and_store(self, key: str, sport: str, compute: Callable[[], Awaitable[str]]) -> str:
+        analysis = await compute()
+        await self.store(key, sport, analysis)
+        return analysis
+
+
+def _lookup(key: str, ttl: timedelta) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        entry = db.get(AnalysisCacheEntry, key)
+        if entry is None:
+            return None
+        now = datetime.utcnow()
+        if entry.created_at < now - ttl:
+            db.delete(entry)
+            db.commit()
+            return None
+        entry.last_used_at = now
+        entry.hits = (entry.hits or 0) + 1
+        analysis = entry.analysis
+        db.commit()
+        return analysis
+    finally:
+        db.close()
+
+
+def _contains(key: str, ttl: timedelta) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(AnalysisCacheEntry.key).filter(
+            AnalysisCacheEntry.key == key,
+            AnalysisCacheEntry.created_at >= datetime.utcnow() - ttl,
+        ).first() is not None
+    finally:
+        db.close()
+
+
+def _store(key: str, sport: str, analysis: str, ttl: timedelta, max_entries: int):
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        db.merge(AnalysisCacheEntry(
+            key=key,
+            sport=sport,
+            analysis=analysis,
+            created_at=now,
+            last_used_at=now,
+            hits=0,
+        ))
+        db.flush()
+
+        # Evict expired entries, then the least recently used beyond the cap
+        db.query(AnalysisCacheEntry).filter(
+            AnalysisCacheEntry.created_at < now - ttl
+        ).delete(synchronize_session=False)
+        overflow = db.query(AnalysisCacheEntry).count() - max_entries
+        if overflow > 0:
+            stale_keys = [
+                row.key for row in db.query(AnalysisCacheEntry.key)
+                .order_by(AnalysisCacheEntry.last_used_at)
+                .limit(overflow)
+            ]
+            db.query(AnalysisCacheEntry).filter(
+                AnalysisCacheEntry.key.in_(stale_keys)
+            ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
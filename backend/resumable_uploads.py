@@ -0,0 +1,217 @@
+"""Resumable chunked uploads for large recordings on unreliable connections.
+
+A client creates a session for a file of known size, PUTs chunks at
+chunk-aligned offsets (in any order, in parallel, and again after a
+failure), asks which offsets are still missing, and finalizes. Chunks are
+written straight into a preallocated file in temp storage and checked
+against an optional SHA-256 sent with them. Finalizing hands that same
+file to the analysis pipeline.
+
+Sessions are kept in memory, so a session belongs to the worker process
+that created it and is lost when that process restarts; the client then
+starts a new one.
+"""
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from observability import UPLOAD_BYTES, get_logger, span
+from temp_storage import TempFile, TempStorage
+from uploads import MAX_UPLOAD_BYTES, MAX_VIDEO_SECONDS, SavedUpload, too_large_detail, probe_duration
+
+UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", str(2 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", "3600"))
+HASH_BLOCK_SIZE = 1024 * 1024
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class UploadSession:
+    id: str
+    user_id: int
+    sport: str
+    filename: Optional[str]
+    size: int
+    chunk_size: int
+    temp: TempFile
+    received: Set[int] = field(default_factory=set)
+    finalizing: bool = False
+    touched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    @property
+    def received_bytes(self) -> int:
+        return sum(self.chunk_length(index) for index in self.received)
+
+    @property
+    def missing_offsets(self) -> List[int]:
+        return [index * self.chunk_size for index in range(self.chunk_count) if index not in self.received]
+
+
+class UploadSessions:
+    def __init__(
+        self,
+        storage: TempStorage,
+        chunk_size: int = UPLOAD_SESSION_CHUNK_SIZE,
+        ttl: float = UPLOAD_SESSION_TTL_SECONDS,
+        max_bytes: int = MAX_UPLOAD_BYTES,
+    ):
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: Dict[str, UploadSession] = {}
+
+    async def create(self, user_id: int, sport: str, filename: Optional[str], size: int) -> UploadSession:
+        self.expire()
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Uploaded video is empty")
+        if size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+
+        # The whole file is charged up front, so a session that was accepted
+        # never runs out of quota halfway through
+        temp = self.storage.open(user_id, filename, prefix="resumable")
+        try:
+            temp.charge(size)
+            await asyncio.to_thread(_preallocate, temp.path, size)
+        except BaseException:
+            temp.close()
+            raise
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            sport=sport,
+            filename=filename,
+            size=size,
+            chunk_size=self.chunk_size,
+            temp=temp,
+        )
+        self._sessions[session.id] = session
+        logger.info("upload session created", extra={
+            "upload_id": session.id, "sport": sport, "bytes": size, "chunks": session.chunk_count,
+        })
+        return session
+
+    def get(self, upload_id: str, user_id: int) -> UploadSession:
+        self.expire()
+        session = self._sessions.get(upload_id)
+        if session is None or session.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        session.touched_at = time.monotonic()
+        return session
+
+    async def write_chunk(
+        self,
+        session: UploadSession,
+        offset: int,
+        body: AsyncIterator[bytes],
+        sha256: Optional[str] = None,
+    ) -> UploadSession:
+        """Writes one chunk in place as it streams in, then verifies it."""
+        if session.finalizing:
+            raise HTTPException(status_code=409, detail="Upload is already being finalized")
+        if offset < 0 or offset >= session.size or offset % session.chunk_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Offset must be a multiple of {session.chunk_size} below {session.size}",
+            )
+        index = offset // session.chunk_size
+        expected = session.chunk_length(index)
+
+        # Rewriting a chunk invalidates it until the new bytes check out
+        session.received.discard(index)
+        digest = hashlib.sha256()
+        written = 0
+        fd = await asyncio.to_thread(os.open, session.temp.path, os.O_WRONLY)
+        try:
+            async for piece in body:
+                if not piece:
+                    continue
+                if written + len(piece) > expected:
+                    raise HTTPException(status_code=413, detail=f"Chunk at offset {offset} must be {expected} bytes")
+                digest.update(piece)
+                await asyncio.to_thread(os.pwrite, fd, piece, offset + written)
+                written += len(piece)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+        if written != expected:
+            raise HTTPException(status_code=400, detail=f"Chunk at offset {offset} must be {expected} bytes, got {written}")
+        if sha256 is not None and digest.hexdigest() != sha256.strip().lower():
+            raise HTTPException(status_code=400, detail=f"Checksum mismatch for chunk at offset {offset}")
+
+        session.received.add(index)
+        session.touched_at = time.monotonic()
+        return session
+
+    async def finalize(self, session: UploadSession) -> Tuple[TempFile, SavedUpload]:
+        """Ends the session and hands over its file; the caller must close the TempFile."""
+        if session.finalizing:
+            raise HTTPException(status_code=409, detail="Upload is already being finalized")
+        missing = session.missing_offsets
+        if missing:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload is incomplete: {len(missing)} of {session.chunk_count} chunks missing",
+            )
+        session.finalizing = True
+        try:
+            with span("assemble", logger, upload_id=session.id, bytes=session.size):
+                sha256 = await asyncio.to_thread(_sha256_file, session.temp.path)
+                duration = await asyncio.to_thread(probe_duration, session.temp.path)
+        except BaseException:
+            session.finalizing = False
+            raise
+        del self._sessions[session.id]
+
+        if duration is not None and duration > MAX_VIDEO_SECONDS:
+            session.temp.close()
+            raise HTTPException(
+                status_code=413,
+                detail=f"Video is too long ({duration:.0f}s). Maximum length is {MAX_VIDEO_SECONDS:.0f} seconds."
+            )
+        UPLOAD_BYTES.labels("received").observe(session.size)
+        return session.temp, SavedUpload(path=session.temp.path, size=session.size, sha256=sha256)
+
+    def discard(self, session: UploadSession):
+        if self._sessions.pop(session.id, None) is not None:
+            session.temp.close()
+
+    def expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for session in list(self._sessions.values()):
+            if session.touched_at < cutoff and not session.finalizing:
+                logger.info("upload session expired", extra={"upload_id": session.id})
+                self.discard(session)
+
+
+def _preallocate(path, size: int):
+    with open(path, "wb") as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except (AttributeError, OSError):
+            # Not every platform or filesystem supports fallocate
+            f.truncate(size)
+
+
+def _sha256_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,209 @@
+"""Temporary storage for uploaded videos while they are being analyzed.
+
+Every upload gets a unique path and is charged against a global and a
+per-user disk quota as it is written. Files are removed when their
+``TempFile`` is closed (it is a context manager), and a background janitor
+sweeps anything left behind, e.g. by a crash, once it is older than
+TEMP_FILE_MAX_AGE_SECONDS. TEMP_UPLOADS_TMPFS=true keeps the files in RAM.
+"""
+import asyncio
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+from observability import TEMP_BYTES, TEMP_QUOTA_REJECTIONS, TEMP_SWEPT_BYTES, get_logger
+
+BASE_DIR = Path(__file__).resolve().parent
+TMPFS_DIR = Path("/dev/shm")
+
+TEMP_UPLOADS_DIR = Path(os.getenv("TEMP_UPLOADS_DIR", str(BASE_DIR / "temp_uploads")))
+TEMP_UPLOADS_TMPFS = os.getenv("TEMP_UPLOADS_TMPFS", "false").lower() in ("1", "true", "yes")
+TEMP_STORAGE_MAX_BYTES = int(os.getenv("TEMP_STORAGE_MAX_MB", "4096")) * 1024 * 1024
+TEMP_STORAGE_USER_MAX_BYTES = int(os.getenv("TEMP_STORAGE_USER_MAX_MB", "1024")) * 1024 * 1024
+TEMP_SWEEP_INTERVAL_SECONDS = float(os.getenv("TEMP_SWEEP_INTERVAL_SECONDS", "300"))
+TEMP_FILE_MAX_AGE_SECONDS = float(os.getenv("TEMP_FILE_MAX_AGE_SECONDS", "3600"))
+
+logger = get_logger(__name__)
+
+
+def default_root() -> Path:
+    if TEMP_UPLOADS_TMPFS:
+        if TMPFS_DIR.is_dir():
+            return TMPFS_DIR / "shadowsync-uploads"
+        logger.warning("tmpfs requested but /dev/shm is missing, using disk", extra={"path": str(TEMP_UPLOADS_DIR)})
+    return TEMP_UPLOADS_DIR
+
+
+class TempFile:
+    """One upload's file and the quota it holds; closing it deletes the file."""
+
+    def __init__(self, storage: "TempStorage", path: Path, user_id: Optional[int]):
+        self.storage = storage
+        self.path = path
+        self.user_id = user_id
+        self.size = 0
+
+    def charge(self, nbytes: int):
+        self.storage._charge(self, nbytes)
+
+    def close(self):
+        self.storage.remove(self.path)
+
+    def __enter__(self) -> "TempFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TempStorage:
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        max_bytes: int = TEMP_STORAGE_MAX_BYTES,
+        user_max_bytes: int = TEMP_STORAGE_USER_MAX_BYTES,
+        sweep_interval: float = TEMP_SWEEP_INTERVAL_SECONDS,
+        max_age: float = TEMP_FILE_MAX_AGE_SECONDS,
+    ):
+        self.root = root or default_root()
+        self.max_bytes = max_bytes
+        self.user_max_bytes = user_max_bytes
+        self.sweep_interval = sweep_interval
+        self.max_age = max_age
+        self._files: Dict[Path, TempFile] = {}
+        self._used = 0
+        self._used_by_user: Dict[Optional[int], int] = {}
+        self._janitor: Optional[asyncio.Task] = None
+
+    def open(self, user_id: Optional[int], filename: Optional[str] = None, prefix: str = "upload") -> TempFile:
+        # The client's filename only contributes its extension, so concurrent
+        # uploads of "recording.webm" never share a path
+        suffix = Path(filename or "").suffix[:16]
+        owner = "anon" if user_id is None else str(user_id)
+        path = self.root / f"{prefix}_{owner}_{uuid.uuid4().hex}{suffix}"
+        temp = TempFile(self, path, user_id)
+        self._files[path] = temp
+        return temp
+
+    def open_derived(self, source: Path, filename: Optional[str] = None, prefix: str = "derived") -> TempFile:
+        """A new file for output made from the file at ``source``, charged to
+        the same user when ``source`` is one of ours."""
+        owner = self._files.get(Path(source))
+        return self.open(owner.user_id if owner else None, filename, prefix=prefix)
+
+    def adopt(self, path: Path, user_id: Optional[int] = None) -> TempFile:
+        """Tracks a file written by an earlier process so the janitor leaves it alone."""
+        path = Path(path)
+        temp = self._files.get(path)
+        if temp is None:
+            temp = self._files[path] = TempFile(self, path, user_id)
+            try:
+                self._charge(temp, path.stat().st_size, enforce=False)
+            except FileNotFoundError:
+                pass
+        return temp
+
+    def remove(self, path: Path):
+        path = Path(path)
+        temp = self._files.pop(path, None)
+        if temp is not None:
+            self._release(temp)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("could not remove temp file", extra={"path": str(path), "error": str(e)})
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used
+
+    def _charge(self, temp: TempFile, nbytes: int, enforce: bool = True):
+        user_used = self._used_by_user.get(temp.user_id, 0)
+        if enforce and temp.user_id is not None and user_used + nbytes > self.user_max_bytes:
+            TEMP_QUOTA_REJECTIONS.labels("user").inc()
+            raise HTTPException(
+                status_code=429,
+                detail="You have too many uploads in progress. Please wait for them to finish.",
+                headers={"Retry-After": "30"},
+            )
+        if enforce and self._used + nbytes > self.max_bytes:
+            TEMP_QUOTA_REJECTIONS.labels("global").inc()
+            raise HTTPException(
+                status_code=503,
+                detail="The server is busy processing other uploads. Please try again shortly.",
+                headers={"Retry-After": "30"},
+            )
+        temp.size += nbytes
+        self._used += nbytes
+        self._used_by_user[temp.user_id] = user_used + nbytes
+        TEMP_BYTES.set(self._used)
+
+    def _release(self, temp: TempFile):
+        self._used -= temp.size
+        remaining = self._used_by_user.get(temp.user_id, 0) - temp.size
+        if remaining > 0:
+            self._used_by_user[temp.user_id] = remaining
+        else:
+            self._used_by_user.pop(temp.user_id, None)
+        temp.size = 0
+        TEMP_BYTES.set(self._used)
+
+    def start(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._sweep_forever())
+        return self._janitor
+
+    async def stop(self):
+        if self._janitor is not None:
+            self._janitor.cancel()
+            await asyncio.gather(self._janitor, return_exceptions=True)
+            self._janitor = None
+
+    async def _sweep_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning("temp sweep failed", extra={"error": str(e)})
+            await asyncio.sleep(self.sweep_interval)
+
+    async def sweep(self) -> int:
+        """Deletes untracked files older than ``max_age``; returns the bytes reclaimed."""
+        started = time.perf_counter()
+        files, reclaimed = await asyncio.to_thread(_sweep_dir, self.root, set(self._files), self.max_age)
+        if files:
+            TEMP_SWEPT_BYTES.inc(reclaimed)
+        logger.info("temp sweep finished", extra={
+            "files": files,
+            "reclaimed_bytes": reclaimed,
+            "in_use_bytes": self._used,
+            "seconds": round(time.perf_counter() - started, 4),
+        })
+        return reclaimed
+
+
+def _sweep_dir(root: Path, in_use: set, max_age: float):
+    cutoff = time.time() - max_age
+    files = reclaimed = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            path = Path(entry.path)
+            if path in in_use or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            files += 1
+            reclaimed += stat.st_size
+    return files, reclaimed
@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from admission import AdmissionController, AdmissionMiddleware, FairScheduler, TokenBucket
+from auth import create_access_token
+from gemini_service import CircuitBreaker, GeminiUnavailable
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_scheduler_serves_users_round_robin():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire(0)
+        served = []
+
+        async def call(user_id):
+            await scheduler.acquire(user_id)
+            served.append(user_id)
+
+        tasks = [asyncio.create_task(call(user_id)) for user_id in (1, 1, 1, 2, 3)]
+        await settle()
+        assert scheduler.depth == 5
+        assert scheduler.position(4) == 3
+        for _ in tasks:
+            scheduler.release()
+            await settle()
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 1, 1]
+
+
+def test_scheduler_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire(1)
+        waiter = asyncio.create_task(scheduler.acquire(2))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.depth == 0
+        scheduler.release()
+        assert scheduler._in_use == 0
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_passes_on_a_slot_handed_to_a_cancelled_waiter():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire(1)
+        first = asyncio.create_task(scheduler.acquire(2))
+        second = asyncio.create_task(scheduler.acquire(3))
+        await settle()
+
+        # The slot is handed to ``first``, which is cancelled before it runs
+        scheduler.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, 1)
+        assert scheduler._in_use == 1
+        assert scheduler.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_slot_context_releases_on_error():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot(1):
+                raise RuntimeError("boom")
+        assert scheduler._in_use == 0
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_refills_at_its_rate():
+    now = time.monotonic()
+    bucket = TokenBucket(rate_per_second=1.0, capacity=2, now=now)
+    assert bucket.wait_time(now) == 0
+    bucket.tokens -= 2
+    assert bucket.wait_time(now) == pytest.approx(1.0)
+    assert bucket.wait_time(now + 0.5) == pytest.approx(0.5)
+    assert bucket.refill(now + 10) == 2
+
+
+def test_admission_charges_admitted_work_only():
+    controller = AdmissionController(FairScheduler(1), rate_per_minute=60, burst=1, max_concurrent_per_user=1)
+    for _ in range(3):
+        with controller.exempt(7):
+            controller.check(7)
+
+    with controller.admit(7):
+        with pytest.raises(HTTPException) as rejected:
+            controller.check(7)
+        assert rejected.value.status_code == 429
+        assert "Retry-After" in rejected.value.headers
+    with pytest.raises(HTTPException):
+        controller.admit(7)
+
+
+def test_middleware_lets_resumable_uploads_start():
+    controller = AdmissionController(FairScheduler(1), rate_per_minute=60, burst=1, max_concurrent_per_user=1)
+    held = controller.admit(7)
+    token = create_access_token({"sub": "user@example.com", "uid": 7})
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def status_for(path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "method": "POST", "path": path,
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+        await AdmissionMiddleware(app, controller)(scope, None, send)
+        return sent[0]["status"]
+
+    assert asyncio.run(status_for("/api/uploads")) == 200
+    assert asyncio.run(status_for("/api/analyze-video/golf")) == 429
+    held.release()
+    assert asyncio.run(status_for("/api/analyze-video/golf")) == 429  # out of tokens
+
+
+def test_breaker_opens_after_threshold_and_probes_after_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()
+
+    breaker.opened_at = time.monotonic() - 30
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_breaker_reopens_on_failed_probe_and_frees_released_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    breaker.opened_at = time.monotonic() - 30
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
@@ -0,0 +1,21 @@
+import time
+
+from auth import AUTH_CACHE_TTL_SECONDS, Principal, PrincipalCache
+
+PRINCIPAL = Principal(id=1, email="a@example.com", username="a", token_version=0)
+
+
+def test_cached_principal_needs_the_current_token_version():
+    cache = PrincipalCache()
+    cache.put(PRINCIPAL)
+    assert cache.get(1, 0) == PRINCIPAL
+    assert cache.get(1, 1) is None
+
+
+def test_entries_expire_so_other_workers_see_revocations(monkeypatch):
+    cache = PrincipalCache()
+    cache.put(PRINCIPAL)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + AUTH_CACHE_TTL_SECONDS + 1)
+    assert cache.get(1, 0) is None
+
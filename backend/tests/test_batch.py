@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from analysis import BatchClip, run_batch_analysis
+from fake_gemini import FakeGeminiClient, FakeGeminiConfig
+from gemini_service import GeminiService
+
+FAST = FakeGeminiConfig(upload_seconds=0, processing_seconds=0, generate_seconds=0, stream_chunks=1, seed=1)
+
+
+class References:
+    """Uploads each sport's reference once, like ReferenceFileRegistry without the database."""
+
+    def __init__(self, gemini, path):
+        self.gemini = gemini
+        self.path = path
+        self.entries = {}
+        self.uploads = 0
+
+    async def get(self, sport):
+        if sport not in self.entries:
+            self.uploads += 1
+            self.entries[sport] = await self.gemini.upload_file(self.path)
+        return self.entries[sport]
+
+    def invalidate(self, sport, name=None):
+        entry = self.entries.get(sport)
+        if entry is not None and (name is None or entry.name == name):
+            del self.entries[sport]
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    service = GeminiService(FakeGeminiClient(FAST))
+    service.broken = {}
+    get_file = service.get_file
+
+    async def breakable_get(name):
+        if name in service.broken:
+            raise service.broken.pop(name)
+        return await get_file(name)
+
+    monkeypatch.setattr(service, "get_file", breakable_get)
+    return service
+
+
+def clips_in(tmp_path, count):
+    clips = []
+    for index in range(count):
+        path = tmp_path / f"clip{index}.mp4"
+        path.write_bytes(bytes([index]) * 1024)
+        clips.append(BatchClip("golf", "Compare the swings.", path))
+    return clips
+
+
+def run_with_broken_file(gemini, references, clips, broken_path, error):
+    async def scenario():
+        await references.get("golf")
+        # Fails the file's first status read, once its upload has finished
+        original = gemini.upload_file
+
+        async def upload_then_break(path):
+            file = await original(path)
+            if path.name == broken_path:
+                gemini.broken[file.name] = error
+            return file
+
+        gemini.upload_file = upload_then_break
+        return await run_batch_analysis(gemini, references, clips)
+
+    return asyncio.run(scenario())
+
+
+def test_one_clips_status_error_only_fails_that_clip(gemini, tmp_path):
+    clips = clips_in(tmp_path, 3)
+    references = References(gemini, tmp_path / "clip0.mp4")
+    results = run_with_broken_file(gemini, references, clips, "clip1.mp4", RuntimeError("status read failed"))
+
+    assert results[1].analysis is None
+    assert "status read failed" in results[1].error
+    for result in (results[0], results[2]):
+        assert result.error is None
+        assert result.analysis.startswith("SIMILARITY SCORE")
+
+
+def test_missing_user_clip_does_not_replace_the_reference(gemini, tmp_path):
+    clips = clips_in(tmp_path, 2)
+    references = References(gemini, tmp_path / "reference.mp4")
+    (tmp_path / "reference.mp4").write_bytes(b"reference")
+    results = run_with_broken_file(gemini, references, clips, "clip0.mp4", FileNotFoundError("gone"))
+
+    assert results[0].error is not None
+    assert results[1].analysis is not None
+    assert references.uploads == 1
+
+
+def test_missing_reference_is_uploaded_again(gemini, tmp_path):
+    clips = clips_in(tmp_path, 2)
+    reference_path = tmp_path / "reference.mp4"
+    reference_path.write_bytes(b"reference")
+    references = References(gemini, reference_path)
+
+    async def scenario():
+        stale = await references.get("golf")
+        gemini.broken[stale.name] = FileNotFoundError("gone")
+        return await run_batch_analysis(gemini, references, clips)
+
+    results = asyncio.run(scenario())
+    assert [result.error for result in results] == [None, None]
+    assert references.uploads == 2
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import history
+from database import Analysis, UserSportStats, create_db_engine
+from migrations import MIGRATIONS, applied_versions, run_migrations, schema_migrations
+
+CONCURRENT_SAVES = 16
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    db_engine = create_db_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    run_migrations(db_engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    monkeypatch.setattr(history, "SessionLocal", factory)
+    yield factory
+    db_engine.dispose()
+
+
+def save_concurrently(calls):
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        return list(pool.map(lambda args: history.save_analysis(*args), calls))
+
+
+def stats_for(factory, user_id, sport):
+    with factory() as db:
+        return db.get(UserSportStats, (user_id, sport))
+
+
+def test_concurrent_saves_keep_aggregates_in_step(session_factory):
+    calls = [(1, "golf", f"Similarity score: {50 + i}%", f"hash-{i}") for i in range(CONCURRENT_SAVES)]
+    ids = save_concurrently(calls)
+
+    assert len(set(ids)) == CONCURRENT_SAVES
+    with session_factory() as db:
+        assert db.query(Analysis).count() == CONCURRENT_SAVES
+    stats = stats_for(session_factory, 1, "golf")
+    assert stats.analysis_count == CONCURRENT_SAVES
+    assert stats.scored_count == CONCURRENT_SAVES
+    assert stats.score_total == sum(50 + i for i in range(CONCURRENT_SAVES))
+    assert stats.best_score == 50 + CONCURRENT_SAVES - 1
+
+
+def test_concurrent_saves_of_one_clip_store_one_row(session_factory):
+    ids = save_concurrently([(1, "golf", "Similarity score: 70%", "same-clip")] * CONCURRENT_SAVES)
+
+    assert len(set(ids)) == 1
+    with session_factory() as db:
+        assert db.query(Analysis).count() == 1
+    stats = stats_for(session_factory, 1, "golf")
+    assert stats.analysis_count == 1
+    assert stats.score_total == 70
+
+
+def test_unscored_and_rejected_analyses(session_factory):
+    assert history.save_analysis(1, "boxing", "REJECTED: no person in frame", "rejected") is None
+    history.save_analysis(1, "boxing", "Similarity score: 40%", "first")
+    history.save_analysis(1, "boxing", "Great form, no score this time", "second")
+    history.save_analysis(1, "boxing", "Similarity score: 30%", None)
+
+    stats = stats_for(session_factory, 1, "boxing")
+    assert stats.analysis_count == 3
+    assert stats.scored_count == 2
+    assert stats.best_score == 40
+    assert stats.last_score == 30
+
+
+def test_migration_drops_duplicates_and_rebuilds_aggregates(tmp_path):
+    db_engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with db_engine.begin() as conn:
+        applied_versions(conn)
+        for version, name, migrate in MIGRATIONS[:3]:
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        for score in (60, 80, 80):
+            conn.execute(text(
+                "INSERT INTO analyses (user_id, sport, created_at, similarity_score, analysis, content_hash) "
+                "VALUES (1, 'golf', :now, :score, 'text', :hash)"
+            ), {"now": datetime.utcnow(), "score": score, "hash": f"h{score}"})
+        conn.execute(text(
+            "INSERT INTO user_sport_stats (user_id, sport, analysis_count, scored_count, score_total) "
+            "VALUES (1, 'golf', 2, 2, 140)"
+        ))
+
+    assert run_migrations(db_engine) == [4]
+    with sessionmaker(bind=db_engine)() as db:
+        assert db.query(Analysis).count() == 2
+        stats = db.get(UserSportStats, (1, "golf"))
+        assert (stats.analysis_count, stats.score_total, stats.best_score) == (2, 140, 80)
+    db_engine.dispose()
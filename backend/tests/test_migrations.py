@@ -0,0 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from database import create_db_engine
+from migrations import MIGRATIONS, applied_versions, run_migrations
+
+
+def test_workers_migrating_together_apply_each_migration_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'workers.db'}"
+    engines = [create_db_engine(url) for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=len(engines)) as pool:
+        applied = list(pool.map(run_migrations, engines))
+
+    assert sorted(version for versions in applied for version in versions) == [v for v, *_ in MIGRATIONS]
+    with engines[0].connect() as conn:
+        assert applied_versions(conn) == {v for v, *_ in MIGRATIONS}
+    for db_engine in engines:
+        db_engine.dispose()
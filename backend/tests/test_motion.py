@@ -0,0 +1,54 @@
+import numpy as np
+
+import motion
+from motion import MOTION_MIN_ENERGY, suppress_cuts
+
+FPS = 5
+SHAPE = (motion.MOTION_FRAME_HEIGHT, motion.MOTION_FRAME_WIDTH)
+
+
+def profile(frames, monkeypatch):
+    monkeypatch.setattr(motion, "_decode_gray_frames", lambda *args: np.array(frames, dtype=np.uint8))
+    return motion._motion_profile("clip.mp4", FPS, SHAPE[1], SHAPE[0])
+
+
+def still(level=100):
+    return np.full(SHAPE, level)
+
+
+def test_short_spike_takes_its_neighbours_level():
+    energy = np.array([0.0, 0.1, 0.9, 0.2, 0.0])
+    assert suppress_cuts(energy).tolist() == [0.0, 0.1, 0.2, 0.2, 0.0]
+
+
+def test_long_run_over_cut_threshold_is_kept():
+    energy = np.array([0.0, 0.7, 0.8, 0.9, 0.0])
+    assert suppress_cuts(energy).tolist() == energy.tolist()
+
+
+def test_panning_clip_is_moving_and_untrimmed(monkeypatch):
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, SHAPE) for _ in range(40)]
+    duration, peak, window = profile(frames, monkeypatch)
+    assert duration == 40 / FPS
+    assert peak >= MOTION_MIN_ENERGY
+    assert window is None
+
+
+def test_scene_cut_in_static_clip_is_not_motion(monkeypatch):
+    frames = [still(100)] * 20 + [still(200)] * 20
+    _, peak, _ = profile(frames, monkeypatch)
+    assert peak < MOTION_MIN_ENERGY
+
+
+def test_motion_around_a_cut_is_one_window(monkeypatch):
+    frames = [still()] * 40
+    for index in range(18, 26):
+        frame = still()
+        frame[:, index:index + 10] = 250
+        frames[index] = frame
+    frames[22] = np.full(SHAPE, 0)
+    _, peak, window = profile(frames, monkeypatch)
+    assert peak >= MOTION_MIN_ENERGY
+    start, end = window
+    assert start < 18 / FPS and end > 26 / FPS
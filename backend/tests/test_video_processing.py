@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import video_processing
+from temp_storage import TempStorage
+from video_processing import normalize_video
+
+ENCODED_BYTES = 300
+
+
+@pytest.fixture(autouse=True)
+def fake_encoder(monkeypatch):
+    def transcode(src, dest, *args):
+        with open(dest, "wb") as f:
+            f.write(b"x" * ENCODED_BYTES)
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(video_processing.shutil, "which", lambda name: "/usr/bin/ffmpeg")
+    monkeypatch.setattr(video_processing, "_transcode", transcode)
+    monkeypatch.setattr(video_processing, "get_pool", lambda: pool)
+    yield
+    pool.shutdown()
+
+
+def upload(storage, user_id, size=1000):
+    temp = storage.open(user_id, "clip.webm")
+    storage.root.mkdir(parents=True, exist_ok=True)
+    temp.path.write_bytes(b"v" * size)
+    temp.charge(size)
+    return temp
+
+
+def test_normalized_copy_is_charged_to_the_uploader(tmp_path):
+    storage = TempStorage(tmp_path)
+    source = upload(storage, user_id=7)
+
+    normalized = asyncio.run(normalize_video(source.path, temp_storage=storage))
+    assert normalized.normalized
+    assert normalized.path.parent == tmp_path
+    assert storage.used_bytes == 1000 + ENCODED_BYTES
+    assert storage._used_by_user[7] == 1000 + ENCODED_BYTES
+
+    normalized.close()
+    assert not normalized.path.exists()
+    assert storage.used_bytes == 1000
+
+
+def test_original_is_used_when_the_copy_is_over_quota(tmp_path):
+    storage = TempStorage(tmp_path, user_max_bytes=1000 + ENCODED_BYTES - 1)
+    source = upload(storage, user_id=7)
+
+    normalized = asyncio.run(normalize_video(source.path, temp_storage=storage))
+    assert not normalized.normalized
+    assert normalized.path == source.path
+    assert storage.used_bytes == 1000
+    assert sorted(p.name for p in tmp_path.iterdir()) == [source.path.name]
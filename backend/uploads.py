@@ -0,0 +1,384 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+
+from observability import UPLOAD_BYTES, get_logger, span
+from temp_storage import TempFile
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+MAX_VIDEO_SECONDS = float(os.getenv("MAX_VIDEO_SECONDS", "60"))
+BATCH_MAX_CLIPS = int(os.getenv("BATCH_MAX_CLIPS", "10"))
+
+# Request bodies on these path prefixes are counted against MAX_UPLOAD_BYTES
+# (times BATCH_MAX_CLIPS for batches), with some slack for the multipart
+# framing around the files themselves
+UPLOAD_PATH_PREFIXES = ("/api/analyze-video/",)
+BATCH_UPLOAD_PATH_PREFIXES = ("/api/analyze-batch",)
+MULTIPART_SLACK_BYTES = 64 * 1024
+# Plain form fields (e.g. a batch's sports) are small and kept in memory
+MAX_FORM_FIELDS = 2 * BATCH_MAX_CLIPS
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class SavedUpload:
+    path: Path
+    size: int
+    sha256: str
+
+
+class _UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects oversized upload bodies with 413 before they are fully received.
+
+    A declared Content-Length is checked up front; otherwise the body is
+    counted as it streams in and the request is cut off once it goes over.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, max_batch_clips: int = BATCH_MAX_CLIPS):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.max_batch_bytes = max_bytes * max_batch_clips
+
+    def _limit_for(self, path: str) -> Optional[int]:
+        if path.startswith(UPLOAD_PATH_PREFIXES):
+            return self.max_bytes
+        if path.startswith(BATCH_UPLOAD_PATH_PREFIXES):
+            return self.max_batch_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self._limit_for(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+        max_body_bytes = max_bytes + MULTIPART_SLACK_BYTES
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > max_body_bytes:
+            await self._reject(send, max_bytes)
+            return
+
+        received = 0
+        too_large = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_bytes:
+                    too_large = True
+                    raise _UploadTooLarge()
+            return message
+
+        async def limited_send(message):
+            nonlocal rejected
+            # The body parser may turn our abort into its own error response;
+            # replace whatever it sends with the 413
+            if too_large:
+                if message["type"] == "http.response.start" and not rejected:
+                    rejected = True
+                    await self._reject(send, max_bytes)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except _UploadTooLarge:
+            if not rejected:
+                rejected = True
+                await self._reject(send, max_bytes)
+
+    async def _reject(self, send, max_bytes: int):
+        body = json.dumps({"detail": too_large_detail(max_bytes)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def too_large_detail(max_bytes: int) -> str:
+    return f"Video is too large. Maximum upload size is {max_bytes // (1024 * 1024)} MB."
+
+
+@dataclass
+class ReceivedFile:
+    field: str
+    filename: Optional[str]
+    temp: TempFile
+    saved: SavedUpload
+
+
+@dataclass
+class ReceivedForm:
+    """A parsed upload form; closing it removes every received file."""
+
+    files: List[ReceivedFile]
+    fields: Dict[str, List[str]]
+
+    def file(self, name: str) -> ReceivedFile:
+        return next(f for f in self.files if f.field == name)
+
+    def files_for(self, name: str) -> List[ReceivedFile]:
+        return [f for f in self.files if f.field == name]
+
+    def close(self):
+        for received in self.files:
+            received.temp.close()
+
+    def __enter__(self) -> "ReceivedForm":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def receive_form(
+    request: Request,
+    open_file: Callable[[Optional[str]], TempFile],
+    required: Sequence[str] = (),
+    max_files: int = 1,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+) -> ReceivedForm:
+    """Parse a multipart body as it arrives, writing file parts straight to temp files.
+
+    Nothing is spooled by the framework first: each file part is hashed,
+    charged to the TempFile that ``open_file`` returns for its filename and
+    written in UPLOAD_CHUNK_SIZE blocks, so a video is written to disk once.
+    ``required`` names the file fields that must be present. On any error
+    every file received so far is removed.
+    """
+    with span("save", logger) as fields:
+        form = await _FormReader(open_file, max_files, max_bytes).read(request, required)
+        fields.update(files=len(form.files), bytes=sum(f.saved.size for f in form.files))
+    for received in form.files:
+        UPLOAD_BYTES.labels("received").observe(received.saved.size)
+    return form
+
+
+def multipart_openapi(properties: Dict[str, dict]) -> dict:
+    """Request body docs for endpoints that parse their multipart body themselves."""
+    schema = {"type": "object", "properties": properties, "required": list(properties)}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+VIDEO_SCHEMA = {"type": "string", "format": "binary"}
+
+
+class _FileWriter:
+    def __init__(self, temp: TempFile, max_bytes: int):
+        self.temp = temp
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.buffer = bytearray()
+        self.f = None
+
+    async def open(self):
+        self.f = await asyncio.to_thread(open, self.temp.path, "wb")
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+        self.temp.charge(len(data))
+        self.digest.update(data)
+        self.buffer += data
+        if len(self.buffer) >= UPLOAD_CHUNK_SIZE:
+            await self._flush()
+
+    async def finish(self) -> SavedUpload:
+        await self._flush()
+        await self.close()
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded video is empty")
+        duration = await asyncio.to_thread(probe_duration, self.temp.path)
+        if duration is not None and duration > MAX_VIDEO_SECONDS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Video is too long ({duration:.0f}s). Maximum length is {MAX_VIDEO_SECONDS:.0f} seconds."
+            )
+        return SavedUpload(path=self.temp.path, size=self.size, sha256=self.digest.hexdigest())
+
+    async def close(self):
+        if self.f is not None:
+            f, self.f = self.f, None
+            await asyncio.to_thread(f.close)
+
+    async def _flush(self):
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), bytearray()
+            await asyncio.to_thread(self.f.write, data)
+
+
+class _FormReader:
+    """Feeds the body to python-multipart and acts on its callbacks.
+
+    The parser's callbacks are synchronous, so they only record events;
+    file I/O happens when the events are drained after each body chunk.
+    """
+
+    def __init__(self, open_file: Callable[[Optional[str]], TempFile], max_files: int, max_bytes: int):
+        self.open_file = open_file
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.form = ReceivedForm([], {})
+        self.events: List[Tuple[str, object]] = []
+        self.opened: List[TempFile] = []
+        self.parts = 0
+        self.field: Optional[Tuple[str, bytearray]] = None
+        self.file: Optional[Tuple[str, Optional[str], _FileWriter]] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+
+    async def read(self, request: Request, required: Sequence[str]) -> ReceivedForm:
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        boundary = options.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+        parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+        try:
+            try:
+                async for chunk in request.stream():
+                    parser.write(chunk)
+                    await self._drain()
+                parser.finalize()
+            except MultipartParseError:
+                raise HTTPException(status_code=400, detail="Malformed multipart upload")
+            await self._drain()
+            if self.file is not None or self.field is not None:
+                raise HTTPException(status_code=400, detail="Upload ended before the last part was complete")
+            missing = [name for name in required if not self.form.files_for(name)]
+            if missing:
+                raise HTTPException(status_code=422, detail=f"Missing file field: {', '.join(missing)}")
+        except BaseException:
+            if self.file is not None:
+                await self.file[2].close()
+            for temp in self.opened:
+                temp.close()
+            raise
+        return self.form
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        self.events.append(("part", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", bytes(data[start:end])))
+
+    def _on_part_end(self):
+        self.events.append(("end", None))
+
+    async def _drain(self):
+        events, self.events = self.events, []
+        for kind, value in events:
+            if kind == "part":
+                await self._begin(value)
+            elif kind == "data":
+                await self._data(value)
+            else:
+                await self._end()
+
+    async def _begin(self, headers: Dict[bytes, bytes]):
+        self.parts += 1
+        if self.parts > self.max_files + MAX_FORM_FIELDS:
+            raise HTTPException(status_code=400, detail="Too many parts in upload")
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if filename is None:
+            self.field = (name, bytearray())
+            return
+        if len(self.opened) >= self.max_files:
+            raise HTTPException(status_code=400, detail=f"Too many videos in one upload (at most {self.max_files})")
+        filename = filename.decode("utf-8", "replace")
+        temp = self.open_file(filename)
+        self.opened.append(temp)
+        writer = _FileWriter(temp, self.max_bytes)
+        self.file = (name, filename, writer)
+        await writer.open()
+
+    async def _data(self, data: bytes):
+        if self.file is not None:
+            await self.file[2].write(data)
+        elif self.field is not None:
+            value = self.field[1]
+            value += data
+            if len(value) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(status_code=400, detail="Form field is too large")
+
+    async def _end(self):
+        if self.file is not None:
+            name, filename, writer = self.file
+            saved = await writer.finish()
+            self.file = None
+            self.form.files.append(ReceivedFile(name, filename, writer.temp, saved))
+        elif self.field is not None:
+            name, value = self.field
+            self.field = None
+            self.form.fields.setdefault(name, []).append(value.decode("utf-8", "replace"))
+
+
+def probe_duration(path: Path) -> Optional[float]:
+    # Duration checks need ffprobe; without it only the size limit applies
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(path)],
+            capture_output=True, text=True, timeout=15,
+        )
+        return float(result.stdout.strip())
+    except (subprocess.SubprocessError, ValueError):
+        return None
+
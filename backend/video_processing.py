@@ -0,0 +1,158 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+from observability import get_logger
+from temp_storage import TempFile, TempStorage
+
+VIDEO_NORMALIZE = os.getenv("VIDEO_NORMALIZE", "true").lower() in ("1", "true", "yes")
+NORMALIZE_MAX_HEIGHT = int(os.getenv("NORMALIZE_MAX_HEIGHT", "480"))
+NORMALIZE_MAX_FPS = int(os.getenv("NORMALIZE_MAX_FPS", "15"))
+NORMALIZE_CRF = int(os.getenv("NORMALIZE_CRF", "28"))
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+NORMALIZE_TIMEOUT = 120
+
+logger = get_logger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class NormalizedVideo:
+    path: Path
+    original_bytes: int
+    normalized_bytes: int
+    seconds: float
+    normalized: bool
+    trimmed: bool = False
+    temp: Optional[TempFile] = None
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.normalized_bytes
+
+    def close(self):
+        """Deletes the normalized copy, if one was written."""
+        if self.temp is not None:
+            self.temp.close()
+        elif self.normalized:
+            _remove_quietly(self.path)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    # Encoding is CPU-bound, so it runs in a small process pool instead of
+    # on the event loop or the shared thread pool
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=VIDEO_WORKERS)
+    return _pool
+
+
+def _noop():
+    return None
+
+
+async def warm_pool():
+    # Forks the encoder processes now instead of on the first upload
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_pool(), _noop)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _transcode(src: str, dest: str, max_height: int, max_fps: int, crf: int, trim: Optional[Tuple[float, float]] = None):
+    ffmpeg = shutil.which("ffmpeg")
+    window = []
+    if trim is not None:
+        start, end = trim
+        window = ["-ss", f"{start:.3f}", "-t", f"{end - start:.3f}"]
+    subprocess.run(
+        [
+            ffmpeg, "-y", "-v", "error", *window, "-i", src,
+            "-an",
+            "-vf", f"scale=-2:'min({max_height},ih)',fps={max_fps}",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart",
+            dest,
+        ],
+        check=True,
+        capture_output=True,
+        timeout=NORMALIZE_TIMEOUT,
+    )
+
+
+async def normalize_video(
+    src: Path,
+    trim: Optional[Tuple[float, float]] = None,
+    temp_storage: Optional[TempStorage] = None,
+) -> NormalizedVideo:
+    """Transcode a user video to a compact, audio-free H.264 MP4.
+
+    ``trim`` is a (start, end) window in seconds to keep; trimming happens in
+    the same encode even when normalization is otherwise disabled. Falls back
+    to the original file when there is nothing to do, ffmpeg is missing,
+    encoding fails, an untrimmed result would not be smaller, or the copy
+    does not fit the uploader's ``temp_storage`` quota. Callers ``close`` the
+    result to delete the copy.
+    """
+    original_bytes = src.stat().st_size
+    unchanged = NormalizedVideo(src, original_bytes, original_bytes, 0.0, False)
+    if not (VIDEO_NORMALIZE or trim) or not shutil.which("ffmpeg"):
+        return unchanged
+
+    # The copy is tracked and charged like the upload it was made from
+    temp = temp_storage.open_derived(src, "normalized.mp4", prefix="normalized") if temp_storage else None
+    dest = temp.path if temp else src.with_name(f"{src.stem}_normalized.mp4")
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(
+            get_pool(), _transcode, str(src), str(dest),
+            NORMALIZE_MAX_HEIGHT, NORMALIZE_MAX_FPS, NORMALIZE_CRF, trim,
+        )
+    except Exception as e:
+        logger.warning("could not normalize video, uploading original", extra={"file": src.name, "error": str(e)})
+        _discard(dest, temp)
+        return unchanged
+    seconds = time.perf_counter() - started
+
+    normalized_bytes = dest.stat().st_size
+    if trim is None and normalized_bytes >= original_bytes and src.suffix.lower() == ".mp4":
+        _discard(dest, temp)
+        return NormalizedVideo(src, original_bytes, original_bytes, seconds, False)
+    if temp is not None:
+        try:
+            temp.charge(normalized_bytes)
+        except HTTPException as e:
+            logger.warning("no temp quota for the normalized video, uploading original",
+                           extra={"file": src.name, "error": e.detail})
+            temp.close()
+            return NormalizedVideo(src, original_bytes, original_bytes, seconds, False)
+    return NormalizedVideo(dest, original_bytes, normalized_bytes, seconds, True, trimmed=trim is not None, temp=temp)
+
+
+def _discard(path: Path, temp: Optional[TempFile]):
+    if temp is not None:
+        temp.close()
+    else:
+        _remove_quietly(path)
+
+
+def _remove_quietly(path: Path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -25,6 +25,11 @@ export interface LoginData {
   password: string;
 }
 
+export interface PasswordChangeData {
+  current_password: string;
+  new_password: string;
+}
+
 export interface AuthResponse {
   access_token: string;
   token_type: string;
@@ -39,16 +44,292 @@ export interface User {
 export interface AnalysisResponse {
   sport: string;
   analysis: string;
+  cached: boolean;
+}
+
+export interface BatchClip {
+  sport: string;
+  video: File;
+}
+
+export interface BatchClipResult {
+  index: number;
+  sport: string;
+  filename: string | null;
+  analysis: string | null;
+  cached: boolean;
+  error: string | null;
+  seconds: number;
+}
+
+export interface BatchAnalysisResponse {
+  results: BatchClipResult[];
+  batch_seconds: number;
+  sum_clip_seconds: number;
+  speedup: number | null;
+}
+
+export interface AnalysisHistoryItem {
+  id: number;
+  sport: string;
+  created_at: string;
+  similarity_score: number | null;
+  analysis: string;
+}
+
+export interface AnalysisHistoryPage {
+  items: AnalysisHistoryItem[];
+  next_cursor: string | null;
+}
+
+export interface SportProgress {
+  sport: string;
+  analysis_count: number;
+  average_score: number | null;
+  best_score: number | null;
+  last_score: number | null;
+  last_analysis_at: string | null;
+}
+
+export type JobStatus = 'queued' | 'running' | 'succeeded' | 'failed';
+
+export interface AnalysisJob {
+  job_id: string;
+  sport: string;
+  status: JobStatus;
+  analysis: string | null;
+  cached: boolean;
+  error: string | null;
+  created_at: string;
+  updated_at: string;
+}
+
+const isJobFinished = (job: AnalysisJob) =>
+  job.status === 'succeeded' || job.status === 'failed';
+
+export interface UploadSession {
+  upload_id: string;
+  sport: string;
+  size: number;
+  chunk_size: number;
+  received_bytes: number;
+  missing_offsets: number[];
+  complete: boolean;
+}
+
+export interface UploadProgress {
+  uploadedBytes: number;
+  totalBytes: number;
+}
+
+// Files above this size go through a resumable chunked upload
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const PARALLEL_CHUNK_UPLOADS = 3;
+const CHUNK_RETRIES = 5;
+const CHUNK_RETRY_BASE_DELAY_MS = 500;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// crypto.subtle only exists in secure contexts; without it chunks are sent
+// unchecksummed and the server skips verification
+const sha256Hex = async (data: ArrayBuffer): Promise<string | undefined> => {
+  if (!globalThis.crypto?.subtle) return undefined;
+  const digest = await crypto.subtle.digest('SHA-256', data);
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Identifies a file across page reloads so an interrupted upload can resume
+const resumeKey = (sport: string, file: File) =>
+  `upload:${sport}:${file.name}:${file.size}:${file.lastModified}`;
+
+const isRetryable = (err: any) => {
+  const status = err?.response?.status;
+  return status === undefined || status === 408 || status === 429 || status >= 500;
+};
+
+export type AnalysisStage = 'received' | 'uploaded' | 'processing' | 'generating';
+
+export interface AnalysisStreamHandlers {
+  onStage?: (stage: AnalysisStage) => void;
+  onChunk?: (text: string) => void;
+  onUploadProgress?: (progress: UploadProgress) => void;
 }
 
+// Parses one Server-Sent Event block ("event: x\ndata: {...}")
+const parseSSEEvent = (block: string) => {
+  let event = 'message';
+  const data: string[] = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      data.push(line.slice(5).trim());
+    }
+  }
+  return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+};
+
+// The connection to an analysis stream failed or closed before the result
+// arrived. The analysis itself may still be running on the server.
+export class StreamInterruptedError extends Error {}
+
+// fetch only rejects when the connection itself fails
+const openStream = (url: string, init: RequestInit) =>
+  fetch(url, init).catch(() => {
+    throw new StreamInterruptedError('Could not connect to the analysis stream');
+  });
+
+// Reads an SSE analysis stream until its done or error event
+const readAnalysisStream = async (
+  response: Response,
+  handlers: AnalysisStreamHandlers
+): Promise<AnalysisResponse> => {
+  if (!response.ok || !response.body) {
+    const body = await response.json().catch(() => null);
+    throw new Error(body?.detail || 'Analysis failed');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read().catch(() => {
+      throw new StreamInterruptedError('The analysis stream was interrupted');
+    });
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+      if (!block.trim() || block.startsWith(':')) continue;
+
+      const { event, data } = parseSSEEvent(block);
+      if (event === 'stage') {
+        handlers.onStage?.(data.stage);
+      } else if (event === 'chunk') {
+        handlers.onChunk?.(data.text);
+      } else if (event === 'done') {
+        return data as AnalysisResponse;
+      } else if (event === 'error') {
+        throw new Error(data?.detail || 'Analysis failed');
+      }
+    }
+  }
+  throw new StreamInterruptedError('Analysis stream ended unexpectedly');
+};
+
+const authHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('token');
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
+export const uploadAPI = {
+  createSession: (sport: string, file: File) =>
+    api.post<UploadSession>('/api/uploads', {
+      sport,
+      size: file.size,
+      filename: file.name,
+    }),
+  getSession: (uploadId: string) => api.get<UploadSession>(`/api/uploads/${uploadId}`),
+  putChunk: async (uploadId: string, offset: number, chunk: Blob) => {
+    const data = await chunk.arrayBuffer();
+    const checksum = await sha256Hex(data);
+    return api.put<UploadSession>(`/api/uploads/${uploadId}/chunks`, data, {
+      params: { offset },
+      headers: {
+        'Content-Type': 'application/octet-stream',
+        ...(checksum ? { 'X-Chunk-SHA256': checksum } : {}),
+      },
+    });
+  },
+  finalize: (uploadId: string) =>
+    api.post<AnalysisResponse>(`/api/uploads/${uploadId}/finalize`),
+  // Uploads the file in chunks, several at a time, retrying failed chunks
+  // with backoff. The session id is kept in localStorage, so after a reload
+  // only the chunks the server is still missing are sent. Returns the
+  // upload id, ready to finalize.
+  uploadResumable: async (
+    sport: string,
+    file: File,
+    onProgress?: (progress: UploadProgress) => void
+  ): Promise<string> => {
+    const key = resumeKey(sport, file);
+    let session: UploadSession | null = null;
+    const saved = localStorage.getItem(key);
+    if (saved) {
+      session = await uploadAPI
+        .getSession(saved)
+        .then((response) => response.data)
+        .catch(() => null);
+    }
+    if (!session) {
+      session = (await uploadAPI.createSession(sport, file)).data;
+      localStorage.setItem(key, session.upload_id);
+    }
+
+    const { upload_id: uploadId, chunk_size: chunkSize } = session;
+    let uploadedBytes = session.received_bytes;
+    onProgress?.({ uploadedBytes, totalBytes: file.size });
+
+    const sendChunk = async (offset: number) => {
+      const chunk = file.slice(offset, offset + chunkSize);
+      for (let attempt = 0; ; attempt++) {
+        try {
+          await uploadAPI.putChunk(uploadId, offset, chunk);
+          uploadedBytes += chunk.size;
+          onProgress?.({ uploadedBytes, totalBytes: file.size });
+          return;
+        } catch (err) {
+          if (attempt >= CHUNK_RETRIES || !isRetryable(err)) throw err;
+          const delay = CHUNK_RETRY_BASE_DELAY_MS * 2 ** attempt;
+          await sleep(delay / 2 + Math.random() * delay);
+        }
+      }
+    };
+
+    // A fixed number of workers pull offsets from a shared list
+    const pending = [...session.missing_offsets];
+    const worker = async () => {
+      for (let offset = pending.shift(); offset !== undefined; offset = pending.shift()) {
+        await sendChunk(offset);
+      }
+    };
+    await Promise.all(Array.from({ length: PARALLEL_CHUNK_UPLOADS }, worker));
+    return uploadId;
+  },
+  // Drops the resume key once finalize has consumed the session or refused
+  // it for good; after a retryable failure the upload can still be finalized
+  forget: (sport: string, file: File) => localStorage.removeItem(resumeKey(sport, file)),
+};
+
 export const authAPI = {
   signup: (data: SignupData) => api.post<AuthResponse>('/api/signup', data),
   login: (data: LoginData) => api.post<AuthResponse>('/api/login', data),
   getMe: () => api.get<User>('/api/me'),
+  changePassword: (data: PasswordChangeData) =>
+    api.post<AuthResponse>('/api/change-password', data),
 };
 
 export const videoAPI = {
-  analyzeVideo: (sport: string, videoFile: File) => {
+  analyzeVideo: async (
+    sport: string,
+    videoFile: File,
+    onProgress?: (progress: UploadProgress) => void
+  ) => {
+    if (videoFile.size > RESUMABLE_UPLOAD_THRESHOLD) {
+      const uploadId = await uploadAPI.uploadResumable(sport, videoFile, onProgress);
+      try {
+        const response = await uploadAPI.finalize(uploadId);
+        uploadAPI.forget(sport, videoFile);
+        return response;
+      } catch (err) {
+        if (!isRetryable(err)) uploadAPI.forget(sport, videoFile);
+        throw err;
+      }
+    }
     const formData = new FormData();
     formData.append('user_video', videoFile);
     return api.post<AnalysisResponse>(`/api/analyze-video/${sport}`, formData, {
@@ -57,7 +338,91 @@ export const videoAPI = {
       },
     });
   },
+  analyzeBatch: (clips: BatchClip[]) => {
+    const formData = new FormData();
+    for (const clip of clips) {
+      formData.append('videos', clip.video);
+      formData.append('sports', clip.sport);
+    }
+    return api.post<BatchAnalysisResponse>('/api/analyze-batch', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+    });
+  },
+  submitAnalysis: (sport: string, videoFile: File) => {
+    const formData = new FormData();
+    formData.append('user_video', videoFile);
+    return api.post<AnalysisJob>(`/api/analyze-video/${sport}/jobs`, formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+    });
+  },
+  getJob: (jobId: string) => api.get<AnalysisJob>(`/api/jobs/${jobId}`),
+  waitForJob: (jobId: string, timeout = 25) =>
+    api.get<AnalysisJob>(`/api/jobs/${jobId}/wait`, { params: { timeout } }),
+  // Long-polls until the job succeeds or fails
+  pollJob: async (
+    jobId: string,
+    onUpdate?: (job: AnalysisJob) => void
+  ): Promise<AnalysisJob> => {
+    let job: AnalysisJob = (await videoAPI.getJob(jobId)).data;
+    onUpdate?.(job);
+    while (!isJobFinished(job)) {
+      job = (await videoAPI.waitForJob(jobId)).data;
+      onUpdate?.(job);
+    }
+    return job;
+  },
+  // Runs the analysis as a background job and long-polls for the result,
+  // which survives proxies that cut long-lived connections
+  analyzeAsJob: async (
+    sport: string,
+    videoFile: File,
+    onUpdate?: (job: AnalysisJob) => void
+  ): Promise<AnalysisResponse> => {
+    const submitted = await videoAPI.submitAnalysis(sport, videoFile);
+    const job = await videoAPI.pollJob(submitted.data.job_id, onUpdate);
+    if (job.status === 'failed' || job.analysis === null) {
+      throw new Error(job.error || 'Analysis failed');
+    }
+    return { sport: job.sport, analysis: job.analysis, cached: job.cached };
+  },
+  // Streams stage updates and analysis text as they are produced. axios cannot
+  // read a response body incrementally in the browser, so this uses fetch.
+  // Large files are uploaded resumably first, then finalized with the same stream.
+  streamAnalysis: async (
+    sport: string,
+    videoFile: File,
+    handlers: AnalysisStreamHandlers = {}
+  ): Promise<AnalysisResponse> => {
+    if (videoFile.size > RESUMABLE_UPLOAD_THRESHOLD) {
+      const uploadId = await uploadAPI.uploadResumable(sport, videoFile, handlers.onUploadProgress);
+      const response = await openStream(`${API_URL}/api/uploads/${uploadId}/finalize/stream`, {
+        method: 'POST',
+        headers: authHeaders(),
+      });
+      if (response.ok || !isRetryable({ response })) uploadAPI.forget(sport, videoFile);
+      return readAnalysisStream(response, handlers);
+    }
+
+    const formData = new FormData();
+    formData.append('user_video', videoFile);
+    const response = await openStream(`${API_URL}/api/analyze-video/${sport}/stream`, {
+      method: 'POST',
+      body: formData,
+      headers: authHeaders(),
+    });
+    return readAnalysisStream(response, handlers);
+  },
   getSports: () => api.get<{ sports: string[] }>('/api/sports'),
 };
 
+export const historyAPI = {
+  listAnalyses: (params: { sport?: string; cursor?: string; limit?: number } = {}) =>
+    api.get<AnalysisHistoryPage>('/api/analyses', { params }),
+  getProgress: () => api.get<{ sports: SportProgress[] }>('/api/analyses/summary'),
+};
+
 export default api;
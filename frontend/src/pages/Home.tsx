@@ -1,7 +1,7 @@
 import React, { useState } from "react";
 import { useNavigate } from "react-router-dom";
 import { useAuth } from "../AuthContext";
-import { videoAPI } from "../api";
+import { videoAPI, StreamInterruptedError, type AnalysisResponse, type AnalysisStage } from "../api";
 import ReactMarkdown from "react-markdown";
 import { PieChart, Pie, Cell, ResponsiveContainer, Legend } from "recharts";
 import "../styles/Home.css";
@@ -37,6 +37,13 @@ const SPORTS = [
   },
 ];
 
+const STAGE_LABELS: Record<AnalysisStage, string> = {
+  received: "Preparing video...",
+  uploaded: "Uploaded...",
+  processing: "Processing video...",
+  generating: "Analyzing...",
+};
+
 const Home: React.FC = () => {
   const { user, logout } = useAuth();
   const navigate = useNavigate();
@@ -44,6 +51,8 @@ const Home: React.FC = () => {
   const [videoFile, setVideoFile] = useState<File | null>(null);
   const [videoPreview, setVideoPreview] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
+  const [stage, setStage] = useState<AnalysisStage | null>(null);
+  const [uploadPercent, setUploadPercent] = useState<number | null>(null);
   const [analysis, setAnalysis] = useState<string | null>(null);
   const [similarityScore, setSimilarityScore] = useState<number | null>(null);
   const [error, setError] = useState<string | null>(null);
@@ -126,19 +135,45 @@ const Home: React.FC = () => {
     setLoading(true);
     setError(null);
     setAnalysis(null);
+    setSimilarityScore(null);
+    setStage(null);
+    setUploadPercent(null);
 
     try {
-      const response = await videoAPI.analyzeVideo(selectedSport, videoFile);
-      const analysisText = response.data.analysis;
+      // Render the analysis as it streams in, then settle on the final text
+      let result: AnalysisResponse;
+      try {
+        result = await videoAPI.streamAnalysis(selectedSport, videoFile, {
+          onStage: setStage,
+          onChunk: (text) => setAnalysis((prev) => (prev ?? "") + text),
+          onUploadProgress: ({ uploadedBytes, totalBytes }) =>
+            setUploadPercent(Math.floor((uploadedBytes / totalBytes) * 100)),
+        });
+      } catch (err) {
+        if (!(err instanceof StreamInterruptedError)) throw err;
+        // The connection dropped, e.g. a proxy timed out the stream. Finish
+        // as a background job: the server keeps analyzing after a disconnect
+        // and answers the same clip from that run rather than starting over.
+        setAnalysis(null);
+        setUploadPercent(null);
+        result = await videoAPI.analyzeAsJob(selectedSport, videoFile, (job) =>
+          setStage(job.status === "running" ? "processing" : "received")
+        );
+      }
+      const analysisText = result.analysis;
       setAnalysis(analysisText);
 
       // Extract similarity score from the analysis
       const score = extractSimilarityScore(analysisText);
       setSimilarityScore(score);
     } catch (err: any) {
-      setError(err.response?.data?.detail || "Analysis failed");
+      setAnalysis(null);
+      // axios errors carry the API's detail; streamed ones put it in the message
+      setError(err.response?.data?.detail || err.message || "Analysis failed");
     } finally {
       setLoading(false);
+      setStage(null);
+      setUploadPercent(null);
     }
   };
 
@@ -381,7 +416,11 @@ const Home: React.FC = () => {
               disabled={loading}
               className="analyze-button"
             >
-              {loading ? "Analyzing..." : "Analyze My Form"}
+              {loading
+                ? stage
+                  ? STAGE_LABELS[stage]
+                  : uploadPercent !== null ? `Uploading... ${uploadPercent}%` : "Uploading..."
+                : "Analyze My Form"}
             </button>
           </div>
         )}